@@ -0,0 +1,50 @@
+import os
+import re
+import shutil
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+# Defaults; each can be overridden per extractor, e.g. DL_FRAGMENTS_YOUTUBE=8
+DEFAULTS = {
+    # Fragments of a DASH/HLS stream fetched at once
+    'DL_FRAGMENTS': '4',
+    # Plain HTTP files: connections aria2c opens per file (1 = yt-dlp's own downloader)
+    'DL_CONNECTIONS': '1',
+    # Plain HTTP files: size of each ranged request, e.g. 10M (0 = one request)
+    'DL_CHUNK_SIZE': '0',
+}
+
+
+def setting(name, extractor, env=os.environ):
+    """Value of a DL_* setting, preferring the extractor-specific variable."""
+    if extractor:
+        suffix = re.sub(r'\W', '_', extractor).upper()
+        value = env.get(f"{name}_{suffix}")
+        if value is not None:
+            return value
+    return env.get(name, DEFAULTS[name])
+
+
+def aria2c_available():
+    return shutil.which('aria2c') is not None
+
+
+def download_options(extractor=None, env=os.environ):
+    """yt-dlp options that parallelize downloads for the given extractor key."""
+    opts = {'concurrent_fragment_downloads': max(1, int(setting('DL_FRAGMENTS', extractor, env)))}
+
+    chunk_size = yt_dlp.utils.parse_bytes(setting('DL_CHUNK_SIZE', extractor, env))
+    if chunk_size:
+        opts['http_chunk_size'] = chunk_size
+
+    connections = int(setting('DL_CONNECTIONS', extractor, env))
+    if connections > 1 and aria2c_available():
+        # Range-split progressive files over several connections
+        opts['external_downloader'] = {'http': 'aria2c'}
+        opts['external_downloader_args'] = {'aria2c': [
+            '-x', str(connections), '-s', str(connections), '-k', '1M',
+            '--summary-interval=1', '--console-log-level=warn',
+        ]}
+    return opts
@@ -0,0 +1,38 @@
+# Telegram albums hold 2 to 10 items
+ALBUM_SIZE = 10
+
+
+def entry_urls(info, limit=None):
+    """Item URLs of a playlist extracted with extract_flat; nested playlists are skipped."""
+    page = info.get('webpage_url')
+    urls = []
+    for entry in info.get('entries') or []:
+        if not entry or entry.get('_type') == 'playlist':
+            continue
+        url = entry.get('webpage_url')
+        # Media found on a generic page name the page itself as theirs
+        if not url or url == page:
+            url = entry.get('url')
+        if url and url.startswith(('http://', 'https://')) and url not in urls:
+            urls.append(url)
+    return urls[:limit]
+
+
+def pack_albums(items, size_of, max_bytes=None, max_items=ALBUM_SIZE):
+    """Split items, in order, into albums of at most max_items and max_bytes.
+
+    size_of(item) gives the bytes an item adds to the upload request; an
+    item bigger than max_bytes on its own still gets an album to itself.
+    """
+    albums = []
+    album, total = [], 0
+    for item in items:
+        size = size_of(item)
+        if album and (len(album) >= max_items or (max_bytes and total + size > max_bytes)):
+            albums.append(album)
+            album, total = [], 0
+        album.append(item)
+        total += size
+    if album:
+        albums.append(album)
+    return albums
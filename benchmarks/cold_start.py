@@ -0,0 +1,121 @@
+"""Cold start of bot.py: time until it polls, and until it answers /start.
+
+Starts `python bot.py` against a fake Bot API whose first getUpdates
+returns a /start message, and times from process spawn to the first
+getUpdates call and to the reply. The boot stages the bot logs
+(imports, ready, yt_dlp, first_response) are collected as well.
+
+    python benchmarks/cold_start.py [--runs 5]
+"""
+import argparse
+import json
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from download_speed import QuietServer
+from load import ROOT, TOKEN, FakeBotAPI
+
+CHAT_ID = 42
+
+
+class ColdStartAPI(FakeBotAPI):
+    """FakeBotAPI that delivers one /start update and notes when things happen."""
+
+    events = {}
+    delivered = False
+
+    def _result(self, method, fields, chat_id):
+        cls = type(self)
+        if method == 'getUpdates':
+            cls.events.setdefault('polling', time.monotonic())
+            if cls.delivered:
+                time.sleep(0.5)
+                return []
+            cls.delivered = True
+            return [{'update_id': 1, 'message': {
+                'message_id': 1, 'date': int(time.time()), 'text': '/start',
+                'chat': {'id': CHAT_ID, 'type': 'private'},
+                'from': {'id': CHAT_ID, 'is_bot': False, 'first_name': 'User'},
+                'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}],
+            }}]
+        if method == 'sendMessage' and chat_id == CHAT_ID:
+            cls.events.setdefault('reply', time.monotonic())
+        return super()._result(method, fields, chat_id)
+
+
+def cold_start(port, workdir, timeout=60):
+    ColdStartAPI.events = {}
+    ColdStartAPI.delivered = False
+    env = {
+        **os.environ,
+        'BOT_TOKEN': TOKEN,
+        'BOT_API_URL': f'http://127.0.0.1:{port}/bot',
+        'LOCAL_MODE': '0',
+        'JOBS_DB': os.path.join(workdir, 'jobs.db'),
+        'FILE_ID_DB': os.path.join(workdir, 'file_ids.db'),
+        'SCRATCH_DIR': os.path.join(workdir, 'scratch'),
+    }
+    started = time.monotonic()
+    proc = subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], cwd=workdir, env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    log = []
+    threading.Thread(target=lambda: log.extend(proc.stderr), daemon=True).start()
+    try:
+        # Wait for the reply, then for the background warm-up if the bot reports boot stages
+        while 'reply' not in ColdStartAPI.events or boot_stages(log).keys() & {'imports', 'yt_dlp'} == {'imports'}:
+            if proc.poll() is not None or time.monotonic() - started > timeout:
+                raise RuntimeError("bot.py did not answer /start:\n" + ''.join(log))
+            time.sleep(0.01)
+    finally:
+        proc.send_signal(signal.SIGTERM)
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+    result = {name: at - started for name, at in ColdStartAPI.events.items()}
+    result.update({f'bot: {stage}': seconds for stage, seconds in boot_stages(log).items()})
+    return result
+
+
+def boot_stages(log):
+    """Boot stages from the bot's log lines, in seconds since bot.py started running."""
+    return {m.group(1): float(m.group(2))
+            for m in (re.search(r'Boot: (\w+) after ([\d.]+)s', line) for line in list(log)) if m}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--output', help="write the medians to this JSON file")
+    args = parser.parse_args()
+
+    api = QuietServer(('127.0.0.1', 0), ColdStartAPI)
+    threading.Thread(target=api.serve_forever, daemon=True).start()
+
+    runs = []
+    for _ in range(args.runs):
+        with tempfile.TemporaryDirectory() as workdir:
+            runs.append(cold_start(api.server_port, workdir))
+    api.shutdown()
+
+    names = sorted({name for run in runs for name in run}, key=lambda name: statistics.median(
+        run[name] for run in runs if name in run))
+    medians = {name: statistics.median(run[name] for run in runs if name in run) for name in names}
+    # "bot: ..." stages leave out interpreter startup, the others are since spawn
+    print(f"{'stage':24} {'median':>8}")
+    for name, seconds in medians.items():
+        print(f"{name:24} {seconds:7.3f}s")
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(medians, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,136 @@
+"""Download speed with and without parallel fetching, against a local server.
+
+The server throttles every connection and adds latency to every request,
+like a CDN far away. It serves an HLS stream made of many small fragments
+and one large progressive file with Range support.
+
+    python benchmarks/download_speed.py [--fragments 40] [--rate 1M] [--latency 0.03]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import yt_dlp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from acceleration import aria2c_available, download_options  # noqa: E402
+
+
+class ThrottledHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    fragments = 40
+    fragment_size = 128 * 1024
+    file_size = 8 * 1024 * 1024
+    rate = 1024 * 1024
+    latency = 0.03
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        if self.path == '/stream.m3u8':
+            lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+            for i in range(self.fragments):
+                lines += ['#EXTINF:2.0,', f'/frag/{i}.ts']
+            lines.append('#EXT-X-ENDLIST')
+            return self._send(200, 'application/vnd.apple.mpegurl', '\n'.join(lines).encode())
+        if self.path.startswith('/frag/'):
+            return self._send(200, 'video/mp2t', b'\x47' * self.fragment_size)
+        if self.path == '/file.mp4':
+            start, end = 0, self.file_size - 1
+            header = self.headers.get('Range')
+            if header:
+                first, _, last = header.split('=', 1)[1].partition('-')
+                start, end = int(first), min(int(last) if last else end, end)
+            extra = {'Content-Range': f'bytes {start}-{end}/{self.file_size}'} if header else {}
+            return self._send(206 if header else 200, 'video/mp4', None, end - start + 1, extra)
+        self._send(404, 'text/plain', b'not found')
+
+    def _send(self, status, content_type, body, length=None, headers=None):
+        length = len(body) if body is not None else length
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(length))
+        self.send_header('Accept-Ranges', 'bytes')
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        # Write in 64 KB pieces at no more than `rate` bytes/s on this connection
+        chunk = 64 * 1024
+        sent = 0
+        try:
+            while sent < length:
+                size = min(chunk, length - sent)
+                self.wfile.write(body[sent:sent + size] if body is not None else b'\0' * size)
+                sent += size
+                time.sleep(size / self.rate)
+        except (BrokenPipeError, ConnectionResetError):
+            # yt-dlp's generic extractor only peeks at the first bytes
+            self.close_connection = True
+
+
+class QuietServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early are expected, not worth a traceback
+        pass
+
+
+def timed_download(url, env):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        opts = {
+            'outtmpl': os.path.join(tmpdir, '%(id)s.%(ext)s'),
+            'quiet': True,
+            'no_warnings': True,
+            'noprogress': True,
+            'fixup': 'never',
+            **download_options('generic', env=env),
+        }
+        started = time.monotonic()
+        with yt_dlp.YoutubeDL(opts) as ydl:
+            ydl.download([url])
+        return time.monotonic() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--fragments', type=int, default=40, help="HLS fragments in the test stream")
+    parser.add_argument('--rate', default='1M', help="bytes/s per connection")
+    parser.add_argument('--latency', type=float, default=0.03, help="seconds added to each request")
+    args = parser.parse_args()
+
+    ThrottledHandler.fragments = args.fragments
+    ThrottledHandler.rate = yt_dlp.utils.parse_bytes(args.rate)
+    ThrottledHandler.latency = args.latency
+    server = QuietServer(('127.0.0.1', 0), ThrottledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f'http://127.0.0.1:{server.server_port}'
+
+    cases = [
+        ('HLS, 1 fragment at a time', '/stream.m3u8', {'DL_FRAGMENTS': '1'}),
+        ('HLS, 4 fragments at a time', '/stream.m3u8', {'DL_FRAGMENTS': '4'}),
+        ('HLS, 8 fragments at a time', '/stream.m3u8', {'DL_FRAGMENTS': '8'}),
+        ('progressive, 1 connection', '/file.mp4', {'DL_CONNECTIONS': '1'}),
+    ]
+    if aria2c_available():
+        cases.append(('progressive, 8 connections (aria2c)', '/file.mp4', {'DL_CONNECTIONS': '8'}))
+    else:
+        print("aria2c not found, skipping the ranged progressive case")
+
+    baseline = {}
+    for name, path, env in cases:
+        elapsed = timed_download(base + path, env)
+        first = baseline.setdefault(path, elapsed)
+        print(f"{name:40} {elapsed:6.2f}s  x{first / elapsed:.1f}")
+
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
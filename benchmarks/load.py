@@ -0,0 +1,406 @@
+"""Concurrent-user load test of bot.py against a fake Bot API and a fake video host.
+
+N simulated users each send a link, wait for the format menu, press a
+button and wait for the file, for a number of rounds. With --playlist the
+link is a page holding that many videos, and the user downloads them all
+as a batch. Each step goes
+through the real handlers and the worker loop. The Bot API stand-in
+records every call, which gives per-phase latencies:
+
+    menu      message sent -> format keyboard shown (extraction)
+    queue     button pressed -> worker starts the job
+    transfer  job started -> file (or the album) received by the Bot API
+    total     message sent -> file received
+
+With --local the Bot API stand-in acts as a local server: the bot hands
+it file:// paths instead of uploading, and each path must exist when the
+request arrives.
+
+Results go to stdout and, with --output, to a JSON file that --compare
+can diff against a run from another commit:
+
+    python benchmarks/load.py --users 20 --size 4M --output new.json --compare old.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qsl, unquote, urlsplit
+
+from download_speed import QuietServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = '123456:benchmark'
+PHASES = ('menu', 'queue', 'transfer', 'total')
+ERROR_PREFIXES = ('❌', '⚠️', '⌛', '🛑', '🐢')
+
+
+class MediaHandler(BaseHTTPRequestHandler):
+    """Serves /video/<name>.mp4 as `size` bytes, at most `rate` bytes/s per connection.
+
+    /page/<name>.html is a web page with `playlist` videos on it.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    size = 2 * 1024 * 1024
+    rate = 0
+    playlist = 0
+
+    def log_message(self, *args):
+        pass
+
+    def do_HEAD(self):
+        self._headers()
+
+    def do_GET(self):
+        page = re.fullmatch(r'/page/(\w+)\.html', self.path)
+        if page:
+            videos = ''.join(f'<video src="/video/{page[1]}i{i}.mp4"></video>' for i in range(self.playlist))
+            body = f'<html><head><title>{page[1]}</title></head><body>{videos}</body></html>'.encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/html')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if not self._headers():
+            return
+        chunk = b'\0' * (64 * 1024)
+        sent = 0
+        while sent < self.size:
+            piece = chunk[:self.size - sent]
+            self.wfile.write(piece)
+            sent += len(piece)
+            if self.rate:
+                time.sleep(len(piece) / self.rate)
+
+    def _headers(self):
+        if not re.fullmatch(r'/video/\w+\.mp4', self.path):
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return False
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/mp4')
+        self.send_header('Content-Length', str(self.size))
+        self.end_headers()
+        return True
+
+
+class FakeBotAPI(BaseHTTPRequestHandler):
+    """Answers Bot API calls with plausible results and reports each one to `on_call`.
+
+    Only a `local` server takes file:// media, and only of files that exist.
+    """
+
+    protocol_version = 'HTTP/1.1'
+    on_call = None
+    local = False
+    message_ids = itertools.count(1)
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = self._read_body()
+        method = self.path.rsplit('/', 1)[-1]
+        fields = self._fields(body)
+        chat_id = int(fields.get('chat_id') or 0)
+        error = self._check_files(fields)
+        if error:
+            payload = json.dumps({'ok': False, 'error_code': 400, 'description': f'Bad Request: {error}'}).encode()
+        else:
+            payload = json.dumps({'ok': True, 'result': self._result(method, fields, chat_id)}).encode()
+        self.send_response(200 if not error else 400)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if not error:
+            type(self).on_call(chat_id, method, fields, len(body))
+
+    do_GET = do_POST
+
+    def _read_body(self):
+        if 'chunked' in self.headers.get('Transfer-Encoding', ''):
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0], 16)
+                if not size:
+                    self.rfile.readline()
+                    return b''.join(parts)
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+        return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+
+    def _fields(self, body):
+        content_type = self.headers.get('Content-Type', '')
+        if content_type.startswith('multipart/'):
+            # Plain fields only; file parts carry a filename and are skipped
+            return {name.decode(): value.decode(errors='replace') for name, value in re.findall(
+                rb'name="([^"]+)"\r\n(?:Content-Type: [^\r]*\r\n)?\r\n(.*?)\r\n--', body, re.DOTALL)}
+        if content_type.startswith('application/json'):
+            return {k: v if isinstance(v, str) else json.dumps(v) for k, v in json.loads(body or b'{}').items()}
+        return dict(parse_qsl(body.decode()))
+
+    def _check_files(self, fields):
+        """Why the request's file:// media can't be taken, None if they can."""
+        for uri in re.findall(r'file://[^"\s]+', ' '.join(fields.values())):
+            if not self.local:
+                return 'wrong remote file identifier specified'
+            if not os.path.isfile(unquote(urlsplit(uri).path)):
+                return f'file {uri} not found'
+        return None
+
+    def _result(self, method, fields, chat_id):
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'Bench', 'username': 'bench_bot'}
+        if method in ('deleteMessage', 'answerCallbackQuery', 'deleteWebhook', 'setWebhook'):
+            return True
+
+        def message(**extra):
+            message_id = next(self.message_ids)
+            return {'message_id': message_id, 'date': int(time.time()),
+                    'chat': {'id': chat_id, 'type': 'private'}, **extra}
+
+        if method in ('sendVideo', 'sendAudio'):
+            kind = 'video' if method == 'sendVideo' else 'audio'
+            media = {'file_id': f'{kind}-{next(self.message_ids)}', 'file_unique_id': 'u', 'duration': 1}
+            if kind == 'video':
+                media.update(width=640, height=360)
+            return message(**{kind: media})
+        if method == 'sendMediaGroup':
+            return [message(video={'file_id': f'video-{next(self.message_ids)}', 'file_unique_id': 'u',
+                                   'duration': 1, 'width': 640, 'height': 360})
+                    for _ in json.loads(fields.get('media') or '[]')]
+        return message(text=fields.get('text', ''))
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+def disk_usage(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass
+    return total
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+async def run(args, workdir):
+    loop = asyncio.get_running_loop()
+    inboxes = {}
+
+    def on_call(chat_id, method, fields, nbytes):
+        inbox = inboxes.get(chat_id)
+        if inbox is not None:
+            loop.call_soon_threadsafe(inbox.put_nowait, (time.monotonic(), method, fields))
+
+    FakeBotAPI.on_call = on_call
+    api = QuietServer(('127.0.0.1', 0), FakeBotAPI)
+    media = QuietServer(('127.0.0.1', 0), MediaHandler)
+    for server in (api, media):
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    # bot.py reads its configuration at import time
+    os.environ.update({
+        'BOT_TOKEN': TOKEN,
+        'BOT_API_URL': f'http://127.0.0.1:{api.server_port}/bot',
+        'LOCAL_MODE': '1' if args.local else '0',
+        'JOBS_DB': os.path.join(workdir, 'jobs.db'),
+        'FILE_ID_DB': os.path.join(workdir, 'file_ids.db'),
+        'STREAM_UPLOADS': '1' if args.stream else '0',
+        'USER_RATE_PER_MIN': '1000',
+        'USER_BURST': '1000',
+        'PROGRESS_INTERVAL': '1',
+        # The media server is on localhost
+        'ALLOW_PRIVATE_LINKS': '1',
+    })
+    tempfile.tempdir = os.path.join(workdir, 'tmp')
+    os.makedirs(tempfile.tempdir)
+    sys.path.insert(0, ROOT)
+    import bot
+    logging.getLogger('httpx').setLevel(logging.WARNING)
+    from telegram import Update
+    from telegram.ext import Application, CallbackContext
+
+    builder = Application.builder().token(TOKEN).base_url(os.environ['BOT_API_URL']).local_mode(args.local)
+    application = builder.request(bot.api_request()).rate_limiter(bot.outbound).build()
+    await application.initialize()
+    worker = asyncio.create_task(bot.work(application.bot))
+    update_ids = itertools.count(1)
+    samples = {phase: [] for phase in PHASES}
+    errors = []
+    peak_disk = 0
+
+    async def sample_disk():
+        nonlocal peak_disk
+        while True:
+            peak_disk = max(peak_disk, await asyncio.to_thread(disk_usage, tempfile.tempdir))
+            await asyncio.sleep(0.2)
+
+    async def next_call(inbox, match):
+        while True:
+            stamp, method, fields = await inbox.get()
+            text = fields.get('text', '')
+            if text.startswith(ERROR_PREFIXES):
+                raise RuntimeError(text.splitlines()[0])
+            if match(method, fields):
+                return stamp, fields
+
+    async def user(user_id):
+        inbox = inboxes[user_id] = asyncio.Queue()
+        person = {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'}
+        chat = {'id': user_id, 'type': 'private'}
+        for round_ in range(args.rounds):
+            name = f'{user_id}' if not args.same_url else 'shared'
+            name += '' if args.same_url else f'r{round_}'
+            if args.playlist:
+                url = f'http://127.0.0.1:{media.server_port}/page/{name}.html'
+            else:
+                url = f'http://127.0.0.1:{media.server_port}/video/{name}.mp4'
+            try:
+                sent = time.monotonic()
+                update = Update.de_json({'update_id': next(update_ids), 'message': {
+                    'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': person, 'text': url,
+                }}, application.bot)
+                await bot.handle_message(update, CallbackContext.from_update(update, application))
+                shown, fields = await next_call(inbox, lambda m, f: 'reply_markup' in f)
+                buttons = [b for row in json.loads(fields['reply_markup'])['inline_keyboard'] for b in row]
+                button = 'as video' if args.playlist else args.button
+                data = next(b['callback_data'] for b in buttons if button in b['text'])
+
+                pressed = time.monotonic()
+                update = Update.de_json({'update_id': next(update_ids), 'callback_query': {
+                    'id': str(next(update_ids)), 'from': person, 'chat_instance': 'bench', 'data': data,
+                    'message': {'message_id': 2, 'date': int(time.time()), 'chat': chat},
+                }}, application.bot)
+                await bot.button_callback(update, CallbackContext.from_update(update, application))
+                started, _ = await next_call(inbox, lambda m, f: f.get('text', '').startswith(('🔄', '🔁', '📚')))
+                done, _ = await next_call(inbox, lambda m, f: m in ('sendVideo', 'sendAudio', 'sendMediaGroup'))
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            samples['menu'].append(shown - sent)
+            samples['queue'].append(started - pressed)
+            samples['transfer'].append(done - started)
+            samples['total'].append(done - sent)
+
+    sampler = asyncio.create_task(sample_disk())
+    began = time.monotonic()
+    await asyncio.gather(*(user(1000 + i) for i in range(args.users)))
+    elapsed = time.monotonic() - began
+    # Let jobs finish their clean-up calls before the bot goes away
+    await asyncio.gather(*bot.running.values(), return_exceptions=True)
+    sampler.cancel()
+    worker.cancel()
+    await application.shutdown()
+    bot.executor.shutdown()
+    await bot.upload_http.aclose()
+    api.shutdown()
+    media.shutdown()
+
+    completed = len(samples['total'])
+    rss = (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+           + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return {
+        'commit': git_commit(),
+        'config': vars(args) | {'compare': None, 'output': None},
+        'completed': completed,
+        'errors': errors,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_per_min': round(completed / elapsed * 60, 2) if elapsed else None,
+        'peak_rss_mb': round(rss / 1024, 1),
+        'peak_disk_mb': round(peak_disk / (1024 * 1024), 1),
+        'phases': {
+            phase: {f'p{p}': round(percentile(values, p), 3) if values else None for p in (50, 95, 99)}
+            for phase, values in samples.items()
+        },
+    }
+
+
+def report(result, baseline=None):
+    print(f"commit {result['commit']}: {result['completed']} downloads in {result['elapsed_s']}s, "
+          f"{result['throughput_per_min']}/min, {len(result['errors'])} errors")
+    print(f"peak RSS {result['peak_rss_mb']} MB, peak temp disk {result['peak_disk_mb']} MB")
+    width = 16 if baseline else 8
+    print(f"{'phase':10} " + ' '.join(f"{key:>{width}}" for key in ('p50', 'p95', 'p99')))
+    for phase in PHASES:
+        row = result['phases'][phase]
+        cells = []
+        for key in ('p50', 'p95', 'p99'):
+            value = row[key]
+            cell = '-' if value is None else f"{value:.3f}"
+            old = baseline and baseline['phases'].get(phase, {}).get(key)
+            if old and value is not None:
+                cell += f" ({(value - old) / old:+.0%})"
+            cells.append(cell)
+        print(f"{phase:10} " + ' '.join(f"{c:>{width}}" for c in cells))
+    for error in sorted(set(result['errors']))[:5]:
+        print(f"error: {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=10, help="simulated users, all active at once")
+    parser.add_argument('--rounds', type=int, default=1, help="downloads per user, one after another")
+    parser.add_argument('--size', default='2M', help="bytes per video")
+    parser.add_argument('--rate', default='0', help="bytes/s per media connection (0 = unlimited)")
+    parser.add_argument('--button', default='Best', help="text of the format button to press")
+    parser.add_argument('--same-url', action='store_true', help="every user asks for the same video")
+    parser.add_argument('--playlist', type=int, default=0,
+                        help="send pages with this many videos and download them as a batch")
+    parser.add_argument('--stream', action='store_true', help="pipe uploads instead of using temp files")
+    parser.add_argument('--local', action='store_true', help="act as a local Bot API server that takes file paths")
+    parser.add_argument('--output', help="write the results as JSON here")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    args = parser.parse_args()
+
+    sys.path.insert(0, ROOT)
+    from yt_dlp.utils import parse_bytes
+    MediaHandler.size = parse_bytes(args.size)
+    MediaHandler.rate = parse_bytes(args.rate)
+    MediaHandler.playlist = args.playlist
+    FakeBotAPI.local = args.local
+
+    with tempfile.TemporaryDirectory() as workdir:
+        result = asyncio.run(run(args, workdir))
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(result, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
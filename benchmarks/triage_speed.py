@@ -0,0 +1,145 @@
+"""Per-message cost of link triage, against what it saves.
+
+Triages a mix of messages (known sites, direct media, pages no site
+extractor takes, local addresses) and reports the time per message. For
+comparison: yt-dlp's own extractor lookup, which tries every extractor in
+turn, and a generic-extractor run on a plain page from a local server
+that answers after --latency seconds, which is what a link without
+triage costs before it fails.
+
+    python benchmarks/triage_speed.py [--rounds 200] [--latency 0.5]
+"""
+import argparse
+import os
+import statistics
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler
+
+import yt_dlp
+
+from download_speed import QuietServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from triage import Triage, find_urls  # noqa: E402
+
+MESSAGES = [
+    "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+    "check this https://youtu.be/dQw4w9WgXcQ?si=abc",
+    "https://m.youtube.com/shorts/aqz-KE-bpKQ",
+    "https://www.instagram.com/reel/C5bGTyFvz3M/?igsh=abc",
+    "https://www.tiktok.com/@scout2015/video/6718335390845095173",
+    "https://vm.tiktok.com/ZMebdL4VR/",
+    "https://twitter.com/i/web/status/910031516746514432",
+    "https://vimeo.com/76979871",
+    "https://www.reddit.com/r/videos/comments/6rrwyj/that_small_heart_attack/",
+    "https://www.facebook.com/watch/?v=274175099429670",
+    "https://www.dailymotion.com/video/x5kesuj",
+    "https://soundcloud.com/forss/flickermood",
+    "https://cdn.example.com/media/clip.mp4",
+    "https://example.com/news/2024/some-article",
+    "https://shop.example.org/product/123?ref=home",
+    "https://example.com/report.pdf",
+    "http://192.168.1.10/admin",
+    "two links https://vimeo.com/76979871 https://example.net/blog/post",
+]
+
+
+class PageHandler(BaseHTTPRequestHandler):
+    """A slow plain web page with no media on it."""
+
+    latency = 0.5
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        body = b'<html><head><title>Article</title></head><body><p>No video here.</p></body></html>'
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class Silent:
+    """yt-dlp logger that drops everything."""
+
+    def debug(self, msg):
+        pass
+
+    warning = error = debug
+
+
+def full_scan(classes, url):
+    for ie in classes:
+        if ie.suitable(url):
+            return ie.ie_key()
+
+
+def timed(func, rounds):
+    """Median microseconds per call of func over `rounds` calls."""
+    samples = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(samples)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rounds', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=0.5)
+    args = parser.parse_args()
+
+    triage = Triage()
+    started = time.perf_counter()
+    triage.build()
+    print(f"index build: {time.perf_counter() - started:.2f}s (once, during warm-up)")
+
+    urls = [url for message in MESSAGES for url in find_urls(message)]
+    outcomes = Counter(triage.route(url).outcome for url in urls)
+    print("outcomes: " + ", ".join(f"{outcome} {count}" for outcome, count in sorted(outcomes.items())))
+
+    classes = list(yt_dlp.extractor.gen_extractor_classes())
+    # The first call of every pattern compiles it, keep that out of the timings
+    for url in urls:
+        full_scan(classes, url)
+
+    def triage_all():
+        for message in MESSAGES:
+            for url in find_urls(message):
+                triage.route(url)
+
+    def scan_all():
+        for url in urls:
+            full_scan(classes, url)
+
+    per_triage = timed(triage_all, args.rounds) / len(MESSAGES)
+    per_scan = timed(scan_all, args.rounds) / len(MESSAGES)
+
+    PageHandler.latency = args.latency
+    server = QuietServer(('127.0.0.1', 0), PageHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    page = f'http://127.0.0.1:{server.server_port}/news/article'
+    ydl = yt_dlp.YoutubeDL({'quiet': True, 'no_warnings': True, 'logger': Silent()})
+    started = time.perf_counter()
+    try:
+        ydl.extract_info(page, download=False)
+    except yt_dlp.utils.DownloadError:
+        pass
+    generic = time.perf_counter() - started
+    server.shutdown()
+
+    print(f"{'per message':34} {'time':>12}")
+    print(f"{'triage':34} {per_triage:10.1f}us")
+    print(f"{'yt-dlp extractor lookup':34} {per_scan:10.1f}us")
+    print(f"{'generic extractor, plain page':34} {generic * 1e6:10.0f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Time to first byte with a new YoutubeDL per job vs. warm pooled instances.
+
+Each job extracts a URL from a local server and downloads it, like
+fetch_media() in the bot; the clock stops at the first progress callback
+that reports downloaded bytes. A fresh instance pays for option parsing,
+extractor lookup, cookie jar and HTTP session setup on every job; pooled
+ones pay once. Sites with per-instance caches (YouTube's player JS and
+signature functions) gain more than the generic extractor measured here.
+
+    python benchmarks/warm_start.py [--jobs 30] [--latency 0.03]
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+import yt_dlp
+
+from download_speed import QuietServer, ThrottledHandler
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from ydl_pool import YoutubeDLPool  # noqa: E402
+
+BASE = {'quiet': True, 'no_warnings': True, 'noprogress': True, 'fixup': 'never'}
+
+
+class FirstByte(Exception):
+    """Stops the download once the first bytes are in."""
+
+
+def first_byte_hook(d):
+    if d.get('status') == 'downloading' and d.get('downloaded_bytes'):
+        raise FirstByte
+
+
+def fresh(url, tmpdir):
+    opts = {**BASE, 'outtmpl': os.path.join(tmpdir, '%(id)s.%(ext)s'), 'progress_hooks': [first_byte_hook]}
+    with yt_dlp.YoutubeDL(opts) as ydl:
+        ydl.extract_info(url, download=True)
+
+
+def pooled(pool):
+    def job(url, tmpdir):
+        overrides = {'outtmpl': os.path.join(tmpdir, '%(id)s.%(ext)s'), 'progress_hooks': [first_byte_hook]}
+        with pool.lease(overrides) as ydl:
+            ydl.extract_info(url, download=True)
+    return job
+
+
+def time_to_first_byte(job, url, runs):
+    timings = []
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            started = time.monotonic()
+            try:
+                job(url, tmpdir)
+            except yt_dlp.utils.DownloadError as e:
+                if not isinstance(e.exc_info[1], FirstByte):
+                    raise
+            except FirstByte:
+                pass
+            timings.append(time.monotonic() - started)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jobs', type=int, default=30, help="downloads per case")
+    parser.add_argument('--latency', type=float, default=0.03, help="seconds added to each request")
+    args = parser.parse_args()
+
+    ThrottledHandler.latency = args.latency
+    server = QuietServer(('127.0.0.1', 0), ThrottledHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f'http://127.0.0.1:{server.server_port}/file.mp4'
+
+    pool = YoutubeDLPool(BASE, max_idle=1)
+    pool.warm()
+    cases = [
+        ('new YoutubeDL per job', fresh),
+        ('pooled YoutubeDL', pooled(pool)),
+    ]
+    # One untimed job per case so imports and lazy extractors are loaded for both
+    for _, job in cases:
+        time_to_first_byte(job, url, 1)
+
+    baseline = None
+    for name, job in cases:
+        timings = sorted(time_to_first_byte(job, url, args.jobs))
+        median = statistics.median(timings)
+        baseline = baseline or median
+        p95 = timings[min(len(timings) - 1, int(len(timings) * 0.95))]
+        print(f"{name:24} median {median * 1000:7.1f} ms  p95 {p95 * 1000:7.1f} ms  x{baseline / median:.2f}")
+    print(f"pool: {pool.created} instances built, {pool.reused} reuses")
+
+    pool.close()
+    server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,12 +1,45 @@
+import time
+
+# Boot timings count from here, before the heavy imports
+BOOT_STARTED = time.monotonic()
+
 import os
 import logging
+import argparse
 import asyncio
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, filters
+import contextlib
+import copy
+import hashlib
+import json
+import signal
+import socket
+from pathlib import Path
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaAudio, InputMediaVideo
+from telegram.ext import (Application, CommandHandler, CallbackQueryHandler, ContextTypes, MessageHandler, TypeHandler,
+                          filters)
 from telegram.constants import ParseMode
-import yt_dlp
+from telegram.error import BadRequest, NetworkError, RetryAfter
 import tempfile
-import re
+from acceleration import download_options
+from batch import ALBUM_SIZE, entry_urls, pack_albums
+from botapi import PooledRequest, SplitRequest, file_url
+from breaker import CircuitBreaker, CircuitOpen, FailureCache, KnownFailure, is_permanent
+from executor import DownloadExecutor, Job, SingleFlight
+from progress import ProgressReporter
+from scheduler import Busy, FairScheduler, TokenBucket
+from streaming import FileTooLarge, MediaPipe, StreamFailed, pick_stream_format, stream_upload, upload_client
+from formats import audio_size, estimate_size, has_audio, has_video, pick_audio, rank_formats
+from metrics import Registry, serve
+from outbound import OutboundScheduler
+from scratch import NoSpace, Scratch
+from sessions import ChoiceStore
+from transcode import Preset, Transcoder
+from triage import Triage, find_urls
+from webhook import InFlight, WebhookServer
+from ydl_pool import YoutubeDLPool
+from jobqueue import JobQueue, is_transient
+from lazy import LazyModule
+from cache import FileIdIndex, MetadataCache, canonical_url, content_key, slim_info
 
 # Configure logging
 logging.basicConfig(
@@ -15,13 +48,363 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# yt-dlp takes a while to import; it loads on first use, or in warm_up()
+yt_dlp = LazyModule('yt_dlp')
+
 # Bot configuration
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 PORT = int(os.environ.get("PORT", 8080))
 WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")
 
-# Store user data
-user_data = {}
+# Webhook deliveries: Telegram opens up to WEBHOOK_MAX_CONNECTIONS (1-100) at
+# once and must send WEBHOOK_SECRET along. At most UPDATE_QUEUE_SIZE updates
+# wait for a handler besides the UPDATE_CONCURRENCY being handled; when no
+# room frees up for WEBHOOK_QUEUE_WAIT seconds the delivery is refused and
+# Telegram tries again later, and polling holds off the next getUpdates.
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", hashlib.sha256((BOT_TOKEN or "").encode()).hexdigest())
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+UPDATE_QUEUE_SIZE = int(os.environ.get("UPDATE_QUEUE_SIZE", 1000))
+WEBHOOK_QUEUE_WAIT = float(os.environ.get("WEBHOOK_QUEUE_WAIT", 5))
+
+# Self-hosted telegram-bot-api server, e.g. BOT_API_URL=http://bot-api:8081/bot
+# (log the bot out of the cloud API once before switching). In local mode the
+# server reads uploads straight from our disk, so it must see SCRATCH_DIR.
+BOT_API_URL = os.environ.get("BOT_API_URL", "")
+BOT_API_FILE_URL = os.environ.get("BOT_API_FILE_URL", file_url(BOT_API_URL))
+LOCAL_MODE = os.environ.get("LOCAL_MODE", "1" if BOT_API_URL else "0") == "1"
+
+# Bot API upload limits: 50 MB in the cloud, 2000 MB on a local server
+UPLOAD_LIMIT = int(os.environ.get("UPLOAD_LIMIT_MB", 2000 if LOCAL_MODE else 50)) * 1024 * 1024
+UPLOAD_TIMEOUT = int(os.environ.get("UPLOAD_TIMEOUT", 600))
+
+# Bot API traffic: updates handled at once, and separate connection pools for
+# media uploads and for everything else, so a long upload never holds up a
+# reply or an edit. Idle connections stay open API_KEEPALIVE seconds.
+UPDATE_CONCURRENCY = int(os.environ.get("UPDATE_CONCURRENCY", 64))
+CONTROL_POOL_SIZE = int(os.environ.get("CONTROL_POOL_SIZE", 64))
+CONTROL_TIMEOUT = float(os.environ.get("CONTROL_TIMEOUT", 10))
+MEDIA_POOL_SIZE = int(os.environ.get("MEDIA_POOL_SIZE", 16))
+API_KEEPALIVE = float(os.environ.get("API_KEEPALIVE", 60))
+
+# Outgoing calls stay within Telegram's flood limits (about 30 messages/s in
+# total, 1/s per private chat, 20/min per group), queued by priority: files,
+# then replies, then progress edits. Flood waits up to API_MAX_RETRY_AFTER
+# seconds are sat out and the call is retried.
+API_GLOBAL_RATE = float(os.environ.get("API_GLOBAL_RATE", 30))
+API_CHAT_RATE = float(os.environ.get("API_CHAT_RATE", 1))
+API_CHAT_BURST = int(os.environ.get("API_CHAT_BURST", 3))
+API_GROUP_PER_MIN = float(os.environ.get("API_GROUP_PER_MIN", 20))
+API_MAX_RETRY_AFTER = int(os.environ.get("API_MAX_RETRY_AFTER", 60))
+
+# Download pool configuration
+DOWNLOAD_WORKERS = int(os.environ.get("DOWNLOAD_WORKERS", 4))
+INFO_TIMEOUT = int(os.environ.get("INFO_TIMEOUT", 60))
+JOB_TIMEOUT = int(os.environ.get("JOB_TIMEOUT", 900))
+
+# Links no site extractor takes go to yt-dlp's generic extractor, which
+# crawls the page. They get GENERIC_INFO_TIMEOUT seconds instead of
+# INFO_TIMEOUT, or are refused outright with GENERIC_LINKS=reject.
+GENERIC_LINKS = os.environ.get("GENERIC_LINKS", "allow")
+GENERIC_INFO_TIMEOUT = int(os.environ.get("GENERIC_INFO_TIMEOUT", 20))
+# Links to localhost and private networks are refused unless this is set
+ALLOW_PRIVATE_LINKS = os.environ.get("ALLOW_PRIVATE_LINKS", "0") == "1"
+
+# An extractor that fails BREAKER_THRESHOLD times in a row (rate limits,
+# login walls, timeouts) is not tried for BREAKER_COOLDOWN seconds, then
+# probed with one request; the pause doubles while probes fail, up to
+# BREAKER_MAX_COOLDOWN. Links that failed for good (private, removed,
+# geo-blocked) are refused for FAILURE_TTL seconds.
+BREAKER_THRESHOLD = int(os.environ.get("BREAKER_THRESHOLD", 5))
+BREAKER_COOLDOWN = int(os.environ.get("BREAKER_COOLDOWN", 60))
+BREAKER_MAX_COOLDOWN = int(os.environ.get("BREAKER_MAX_COOLDOWN", 900))
+FAILURE_TTL = int(os.environ.get("FAILURE_TTL", 600))
+
+# Warm YoutubeDL instances are reused across jobs, keeping extractor caches,
+# cookies and HTTP connections; each is rebuilt after YDL_MAX_USES jobs.
+# YDL_CACHE_DIR moves yt-dlp's disk cache (player JS, signature functions).
+YDL_MAX_USES = int(os.environ.get("YDL_MAX_USES", 200))
+YDL_CACHE_DIR = os.environ.get("YDL_CACHE_DIR", "")
+
+# Admission control: download slots per resource class, and per-user limits
+SLOTS_NETWORK = int(os.environ.get("SLOTS_NETWORK", DOWNLOAD_WORKERS))
+SLOTS_CPU = int(os.environ.get("SLOTS_CPU", os.cpu_count() or 1))
+USER_MAX_JOBS = int(os.environ.get("USER_MAX_JOBS", 2))
+USER_MAX_QUEUED = int(os.environ.get("USER_MAX_QUEUED", 5))
+USER_RATE_PER_MIN = float(os.environ.get("USER_RATE_PER_MIN", 10))
+USER_BURST = int(os.environ.get("USER_BURST", 5))
+
+# Metadata cache configuration (media URLs usually expire after a few hours)
+METADATA_CACHE_SIZE = int(os.environ.get("METADATA_CACHE_SIZE", 512))
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", 1800))
+METADATA_CACHE_DB = os.environ.get("METADATA_CACHE_DB", "")
+
+# Telegram file_id index, so popular files are uploaded only once
+FILE_ID_DB = os.environ.get("FILE_ID_DB", "file_ids.db")
+
+# Progress messages: seconds between edits of one message, edits/s across all jobs
+PROGRESS_INTERVAL = float(os.environ.get("PROGRESS_INTERVAL", 3))
+PROGRESS_EDITS_PER_SEC = float(os.environ.get("PROGRESS_EDITS_PER_SEC", 10))
+
+# Disk budget for downloads: jobs reserve their estimated size up front and
+# wait (then fail) when SCRATCH_BUDGET_MB would be exceeded or the disk has
+# less than SCRATCH_MIN_FREE_MB left
+SCRATCH_DIR = os.environ.get("SCRATCH_DIR", os.path.join(tempfile.gettempdir(), "video-bot"))
+SCRATCH_BUDGET = int(os.environ.get("SCRATCH_BUDGET_MB", 4096)) * 1024 * 1024
+SCRATCH_MIN_FREE = int(os.environ.get("SCRATCH_MIN_FREE_MB", 256)) * 1024 * 1024
+SCRATCH_WAIT = int(os.environ.get("SCRATCH_WAIT", 300))
+
+# Pipe single-file formats from yt-dlp into the upload instead of a temp file
+STREAM_UPLOADS = os.environ.get("STREAM_UPLOADS", "1") == "1"
+STREAM_BUFFER_CHUNKS = int(os.environ.get("STREAM_BUFFER_CHUNKS", 16))
+
+# Audio conversion: ffmpeg processes run at most TRANSCODE_PROCS at a time, and
+# sources already in an AUDIO_PASSTHROUGH codec are sent without re-encoding
+TRANSCODE_PROCS = int(os.environ.get("TRANSCODE_PROCS", os.cpu_count() or 1))
+AUDIO_CODEC = os.environ.get("AUDIO_CODEC", "libmp3lame")
+AUDIO_EXT = os.environ.get("AUDIO_EXT", "mp3")
+AUDIO_BITRATE = int(os.environ.get("AUDIO_BITRATE", 192))
+AUDIO_THREADS = int(os.environ.get("AUDIO_THREADS", 1))
+AUDIO_PASSTHROUGH = [c for c in os.environ.get("AUDIO_PASSTHROUGH", "mp4a,mp3").split(",") if c]
+
+# Durable job queue: failed jobs retry with exponential backoff, and updates
+# that were never handled are replayed after a restart if not too old
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.db")
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 4))
+JOB_RETRY_BACKOFF = int(os.environ.get("JOB_RETRY_BACKOFF", 30))
+REPLAY_WINDOW = int(os.environ.get("REPLAY_WINDOW", 900))
+POLL_TIMEOUT = 30
+
+# Process role: 'frontend' takes updates and queues jobs, 'worker' runs them,
+# 'all' does both in one process. Workers share the job database as broker,
+# each holding at most WORKER_JOBS jobs under a lease of JOB_LEASE seconds.
+ROLE = os.environ.get("ROLE", "all")
+WORKER_ID = os.environ.get("WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+WORKER_JOBS = int(os.environ.get("WORKER_JOBS", SLOTS_NETWORK + SLOTS_CPU))
+JOB_LEASE = int(os.environ.get("JOB_LEASE", 120))
+WORKER_POLL = float(os.environ.get("WORKER_POLL", 2))
+
+# Batches (playlists, messages with several links): items per batch, items
+# fetched at once, and bytes per album request when files are uploaded
+BATCH_MAX_ITEMS = int(os.environ.get("BATCH_MAX_ITEMS", 25))
+BATCH_CONCURRENCY = int(os.environ.get("BATCH_CONCURRENCY", USER_MAX_JOBS))
+ALBUM_MAX_BYTES = int(os.environ.get("ALBUM_MAX_MB", 200)) * 1024 * 1024
+
+# Prometheus metrics on http://0.0.0.0:METRICS_PORT/metrics (0 = off). Give each
+# process on a host its own port.
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+
+# Format buttons stay valid this long, across restarts; at most this many are kept
+CHOICE_TTL = int(os.environ.get("CHOICE_TTL", 3600))
+CHOICE_MAX = int(os.environ.get("CHOICE_MAX", 20000))
+
+VIDEO_CAPTION = "📹 Downloaded by Video Downloader Bot"
+AUDIO_CAPTION = "🎵 Converted to audio by Video Downloader Bot"
+
+# Accepted jobs and unhandled updates, kept on disk
+jobs = JobQueue(JOBS_DB, max_attempts=JOB_MAX_ATTEMPTS, backoff=JOB_RETRY_BACKOFF)
+
+# This process's worker loop and the jobs it is running, by job id
+worker_task = None
+warmup_task = None
+replay_task = None
+running = {}
+job_ready = asyncio.Event()
+
+# ffmpeg stage for the audio button
+audio_preset = Preset('audio', AUDIO_CODEC, AUDIO_EXT, AUDIO_BITRATE, AUDIO_THREADS, AUDIO_PASSTHROUGH)
+transcoder = Transcoder(TRANSCODE_PROCS)
+
+# Pending format buttons, referenced by short tokens in callback_data; kept
+# next to the jobs so that menus on screen still work after a restart
+choices = ChoiceStore(JOBS_DB, ttl=CHOICE_TTL, max_entries=CHOICE_MAX)
+
+# All blocking yt-dlp work runs here, never on the event loop
+executor = DownloadExecutor(max_workers=DOWNLOAD_WORKERS, timeout=JOB_TIMEOUT)
+
+# YoutubeDL instances shared by the pool threads, one thread at a time each
+ydl_pool = YoutubeDLPool(
+    {'quiet': True, **({'cachedir': YDL_CACHE_DIR} if YDL_CACHE_DIR else {})},
+    max_idle=DOWNLOAD_WORKERS,
+    max_uses=YDL_MAX_USES,
+)
+
+# Fair, per-user limited access to download slots
+scheduler = FairScheduler(
+    slots={'network': SLOTS_NETWORK, 'cpu': SLOTS_CPU},
+    per_user=USER_MAX_JOBS,
+    max_queued=USER_MAX_QUEUED,
+    rate=USER_RATE_PER_MIN / 60,
+    burst=USER_BURST,
+)
+
+# extract_info results shared by the format menu and the download
+metadata_cache = MetadataCache(
+    max_entries=METADATA_CACHE_SIZE,
+    ttl=METADATA_CACHE_TTL,
+    path=METADATA_CACHE_DB or None,
+)
+
+# file_ids of everything already uploaded, keyed by content_key()
+file_index = FileIdIndex(FILE_ID_DB)
+
+# In-flight downloads keyed by (canonical URL, format choice)
+downloads = SingleFlight()
+
+# Progress edits of all jobs together stay under this budget
+edit_budget = TokenBucket(PROGRESS_EDITS_PER_SEC)
+
+# Every Bot API call except getUpdates goes through here
+outbound = OutboundScheduler(
+    global_rate=API_GLOBAL_RATE,
+    chat_rate=API_CHAT_RATE,
+    chat_burst=API_CHAT_BURST,
+    group_rate=API_GROUP_PER_MIN / 60,
+    max_retry_after=API_MAX_RETRY_AFTER,
+)
+
+# Routes links to their extractor, the index is built in warm_up()
+link_triage = Triage(reject_generic=GENERIC_LINKS == "reject", allow_private=ALLOW_PRIVATE_LINKS)
+
+# Health of each extractor, and links known to fail
+breaker = CircuitBreaker(threshold=BREAKER_THRESHOLD, cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN)
+failures = FailureCache(ttl=FAILURE_TTL)
+
+# Incoming updates waiting for a handler, when each came in, and the cap on
+# those not handled yet
+update_queue = asyncio.Queue(UPDATE_QUEUE_SIZE)
+ingested = {}
+in_flight = InFlight(UPDATE_QUEUE_SIZE + UPDATE_CONCURRENCY)
+
+# Per-job download directories within the disk budget
+scratch = Scratch(SCRATCH_DIR, SCRATCH_BUDGET, min_free=SCRATCH_MIN_FREE, max_wait=SCRATCH_WAIT)
+
+# HTTP client for streamed uploads
+upload_http = upload_client()
+
+# Where time goes: per-phase timings, throughput, queues and caches
+registry = Registry()
+metrics_server = None
+phase_seconds = registry.histogram('bot_phase_seconds', "Time spent per job phase", ('phase', 'extractor'))
+bytes_in = registry.counter('bot_download_bytes_total', "Media bytes downloaded", ('extractor',))
+bytes_out = registry.counter('bot_upload_bytes_total', "Media bytes sent to Telegram", ('extractor',))
+transcode_cpu = registry.counter('bot_transcode_cpu_seconds_total', "CPU seconds used by ffmpeg")
+job_outcomes = registry.counter('bot_jobs_total', "Finished job attempts by outcome", ('outcome',))
+api_seconds = registry.histogram('bot_telegram_api_seconds', "Bot API request latency", ('method',))
+api_throttled = registry.counter('bot_telegram_429_total', "Bot API flood-wait answers", ('method',))
+triage_outcomes = registry.counter('bot_triage_total', "Links triaged, by outcome", ('outcome',))
+registry.gauge('bot_circuit_open', "Extractors refused by the circuit breaker", ('extractor',),
+               func=lambda: {(key,): 1 for key in breaker.open})
+registry.counter('bot_circuit_opened_total', "Times an extractor's circuit opened", func=lambda: breaker.opened)
+registry.counter('bot_known_failures_total', "Requests refused for links that failed lately",
+                 func=lambda: failures.hits)
+registry.gauge('bot_scheduler_queued', "Jobs waiting for a download slot", func=lambda: scheduler.queued)
+registry.gauge('bot_scheduler_active', "Jobs holding a download slot", func=lambda: scheduler.active)
+registry.gauge('bot_outbound_queued', "Bot API calls waiting for the flood limits", func=lambda: outbound.queued)
+registry.counter('bot_outbound_superseded_total', "Queued edits replaced by a newer edit",
+                 func=lambda: outbound.superseded)
+registry.counter('bot_outbound_retries_total', "Bot API calls retried after a flood wait",
+                 func=lambda: outbound.retried)
+update_wait = registry.histogram('bot_update_wait_seconds', "Time from receiving an update to handling it",
+                                 buckets=(0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 30, float('inf')))
+webhook_refused = registry.counter('bot_webhook_refused_total', "Webhook deliveries refused with no room")
+registry.gauge('bot_update_queued', "Updates taken in and not handled yet", func=lambda: len(in_flight))
+registry.gauge('bot_broker_jobs', "Jobs in the broker, queued or running", func=lambda: len(jobs))
+registry.gauge('bot_worker_jobs', "Jobs claimed by this process", func=lambda: len(running))
+registry.counter('bot_cache_lookups_total', "Cache lookups by result", ('cache', 'result'), func=lambda: {
+    ('metadata', 'hit'): metadata_cache.hits,
+    ('metadata', 'miss'): metadata_cache.misses,
+    ('file_id', 'hit'): file_index.hits,
+    ('file_id', 'miss'): file_index.misses,
+})
+
+# Seconds from BOOT_STARTED to each boot stage, see boot_stage()
+boot_times = {}
+registry.gauge('bot_boot_seconds', "Seconds from process start to each boot stage", ('stage',),
+               func=lambda: {(stage,): seconds for stage, seconds in boot_times.items()})
+
+def boot_stage(stage):
+    """Record and log when a boot stage is first reached.
+    
+    Stages: imports (bot.py loaded), ready (taking updates), yt_dlp
+    (yt-dlp imported and warmed up) and first_response (first update handled).
+    """
+    if stage not in boot_times:
+        boot_times[stage] = time.monotonic() - BOOT_STARTED
+        logger.info(f"Boot: {stage} after {boot_times[stage]:.2f}s")
+
+def fetch_info(url):
+    """Extract video metadata without downloading and cache it (runs in the pool)."""
+    # Playlists come back as flat entries, only as many as a batch takes
+    ydl_opts = {
+        'extract_flat': 'in_playlist',
+        'lazy_playlist': True,
+        'playlistend': BATCH_MAX_ITEMS,
+    }
+    with ydl_pool.lease(ydl_opts) as ydl, phase_seconds.time(phase='extract_info') as labels:
+        info = slim_info(ydl.extract_info(url, download=False, ie_key=link_triage.route(url).ie_key))
+        labels['extractor'] = info.get('extractor_key')
+    metadata_cache.put(url, info)
+    return info
+
+def fetch_media(url, ydl_opts):
+    """Download url with ydl_opts, returns (info, filename) (runs in the pool)."""
+    cached = metadata_cache.get(url)
+    with ydl_pool.lease(ydl_opts) as ydl:
+        if cached is not None:
+            try:
+                # Reuse the metadata from the format menu instead of re-extracting
+                info = ydl.process_ie_result(copy.deepcopy(cached), download=True)
+                return info, ydl.prepare_filename(info)
+            except yt_dlp.utils.DownloadError as e:
+                logger.warning(f"Cached info for {url} failed ({e}), extracting again")
+                metadata_cache.invalidate(url)
+        info = ydl.extract_info(url, download=True, ie_key=link_triage.route(url).ie_key)
+        return info, ydl.prepare_filename(info)
+
+async def get_info(url, job=None, timeout=INFO_TIMEOUT):
+    """Cached metadata, or fetch_info() in the pool unless the link or its extractor is known to fail.
+    
+    Raises KnownFailure or CircuitOpen right away instead of tying up a
+    worker, and feeds the outcome back to the breaker and failure cache.
+    """
+    failures.check(url)
+    info = metadata_cache.get(url)
+    if info is not None:
+        return info
+    extractor = link_triage.route(url).ie_key
+    if extractor is None:
+        # Generic pages failing say nothing about any one site
+        try:
+            return await executor.run(fetch_info, url, job=job, timeout=timeout)
+        except Exception as e:
+            if is_permanent(e):
+                failures.add(url, e)
+            raise
+    
+    breaker.allow(extractor)
+    try:
+        info = await executor.run(fetch_info, url, job=job, timeout=timeout)
+    except yt_dlp.utils.DownloadCancelled:
+        breaker.release(extractor)
+        raise
+    except Exception as e:
+        if is_permanent(e):
+            # The extractor did its job, the video is out of reach
+            failures.add(url, e)
+            breaker.release(extractor)
+        else:
+            breaker.failure(extractor)
+        raise
+    except BaseException:
+        breaker.release(extractor)
+        raise
+    breaker.success(extractor)
+    return info
+
+def select_stream_format(info, spec):
+    """pick_stream_format() with a pooled YoutubeDL (runs in the pool)."""
+    with ydl_pool.lease() as ydl:
+        return pick_stream_format(info, spec, ydl)
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Send a welcome message when the command /start is issued."""
@@ -47,6 +430,7 @@ I can download videos from various platforms and convert them to audio!
 /start - Show this message
 /help - Get help
 /audio - Convert video to audio only
+/cancel - Stop your running downloads
 """
     
     await update.message.reply_text(welcome_text, parse_mode=ParseMode.MARKDOWN)
@@ -61,6 +445,7 @@ Just send me a video URL and I'll handle the rest!
 *Features:*
 • Download videos in different qualities
 • Convert to audio (MP3)
+• Playlists and several links at once
 • Progress indicators
 • Support for 1000+ sites
 
@@ -70,71 +455,83 @@ Just send me a video URL and I'll handle the rest!
 
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle incoming messages containing URLs."""
-    message_text = update.message.text
-    
     # Check if message contains URL
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+[/\w .\-?=&%]*'
-    urls = re.findall(url_pattern, message_text)
+    urls = find_urls(update.message.text)
     
     if not urls:
         await update.message.reply_text("Please send me a valid video URL!")
         return
     
-    url = urls[0]
+    # Drop links that are not worth handing to yt-dlp
+    routes = [link_triage.route(url) for url in urls]
+    for route in routes:
+        triage_outcomes.inc(outcome=route.outcome)
+    accepted = [route for route in routes if not route.rejected]
+    if not accepted:
+        await update.message.reply_text(f"⚠️ I can't download that link: {routes[0].rejected}.")
+        return
     
-    # Get video info
+    url = accepted[0].url
+    
+    if not scheduler.admit(update.effective_user.id):
+        await update.message.reply_text("🐢 You're sending requests too fast. Please wait a minute.")
+        return
+    
+    if len(accepted) > 1:
+        await offer_batch(update, [route.url for route in accepted][:BATCH_MAX_ITEMS], f"{len(accepted)} links")
+        return
+    
+    # Get video info; crawling an unknown page gets less time
+    timeout = GENERIC_INFO_TIMEOUT if accepted[0].generic and not accepted[0].direct else INFO_TIMEOUT
     try:
         await update.message.reply_text("🔍 Fetching video information...")
         
-        ydl_opts = {'quiet': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Check if it's a playlist
-            if 'entries' in info:
-                await update.message.reply_text("⚠️ Playlists are not supported. Please send a single video URL.")
+        job = Job(f"info:{url}", owner=update.effective_user.id)
+        info = await get_info(url, job=job, timeout=timeout)
+        
+        # Playlists are downloaded as a batch
+        if 'entries' in info:
+            items = entry_urls(info, BATCH_MAX_ITEMS)
+            if not items:
+                await update.message.reply_text("⚠️ This playlist has no videos I can download.")
                 return
-            
-            # Create quality/format selection keyboard
-            keyboard = []
-            
-            # Audio only option
-            keyboard.append([InlineKeyboardButton("🎵 Audio Only (MP3)", callback_data=f"format_{url}_audio")])
-            
-            # Video quality options
-            if 'formats' in info:
-                formats = info['formats']
-                # Filter video formats
-                video_formats = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
-                
-                # Get unique resolutions
-                resolutions = {}
-                for fmt in video_formats:
-                    res = fmt.get('resolution', 'N/A')
-                    if res != 'N/A' and res not in resolutions:
-                        resolutions[res] = fmt
-                
-                # Add quality options (limit to 5)
-                for i, (res, fmt) in enumerate(list(resolutions.items())[:5]):
-                    keyboard.append([
-                        InlineKeyboardButton(f"📹 Video {res}", 
-                         callback_data=f"format_{url}_video_{fmt['format_id']}")
-                    ])
-            
-            # Add best quality option
+            await offer_batch(update, items, info.get('title') or "Playlist")
+            return
+        
+        # Create quality/format selection keyboard
+        keyboard = []
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+        
+        def choice_data(format_type):
+            return f"format_{choices.add(user_id, chat_id, url, format_type)}"
+        
+        # Audio only option, unless even the converted audio would be too large
+        mp3_size = audio_size(info.get('duration'), AUDIO_BITRATE)
+        if not mp3_size or mp3_size <= UPLOAD_LIMIT:
+            keyboard.append([InlineKeyboardButton("🎵 Audio Only", callback_data=choice_data("audio"))])
+        
+        # Video quality options that fit under the upload limit (limit to 5)
+        for option in rank_formats(info, UPLOAD_LIMIT, max_options=5):
             keyboard.append([
-                InlineKeyboardButton("🏆 Best Quality", 
-                 callback_data=f"format_{url}_best")
+                InlineKeyboardButton(option.label, 
+                 callback_data=choice_data(f"video_{option.spec}"))
             ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Send video info with options
-            title = info.get('title', 'Unknown Title')
-            duration = info.get('duration', 0)
-            duration_str = f"{duration//60}:{duration%60:02d}" if duration else "Unknown"
-            
-            caption = f"""
+        
+        # Add best quality option
+        keyboard.append([
+            InlineKeyboardButton("🏆 Best Quality", 
+             callback_data=choice_data("best"))
+        ])
+        
+        reply_markup = InlineKeyboardMarkup(keyboard)
+        
+        # Send video info with options
+        title = info.get('title', 'Unknown Title')
+        duration = info.get('duration', 0)
+        duration_str = f"{duration//60}:{duration%60:02d}" if duration else "Unknown"
+        
+        caption = f"""
 📹 *Video Found!*
 
 *Title:* {title}
@@ -142,718 +539,800 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 Select download option:
 """
-            
-            await update.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            
+        
+        await update.message.reply_text(
+            caption,
+            reply_markup=reply_markup,
+            parse_mode=ParseMode.MARKDOWN
+        )
+        
+    except asyncio.TimeoutError:
+        await update.message.reply_text("⌛ The site took too long to respond. Please try again later.")
+    except CircuitOpen as e:
+        await update.message.reply_text(
+            f"⏳ {e.key} isn't answering right now. Please try again in {max(1, round(e.retry_after / 60))} min.")
+    except KnownFailure as e:
+        await update.message.reply_text(f"❌ This video can't be downloaded: {e}")
     except Exception as e:
         logger.error(f"Error fetching video info: {e}")
         await update.message.reply_text(f"❌ Error: {str(e)}")
 
+async def offer_batch(update: Update, items, title):
+    """Ask how to download a batch of item URLs."""
+    user_id = update.effective_user.id
+    chat_id = update.effective_chat.id
+    # A batch choice carries its item URLs as a JSON list
+    data = json.dumps(items)
+    keyboard = [
+        [InlineKeyboardButton(f"📹 All {len(items)} as video",
+         callback_data=f"format_{choices.add(user_id, chat_id, data, 'batch_best')}")],
+        [InlineKeyboardButton(f"🎵 All {len(items)} as audio",
+         callback_data=f"format_{choices.add(user_id, chat_id, data, 'batch_audio')}")],
+    ]
+    
+    caption = f"""
+📚 *Batch Found!*
+
+*Title:* {title}
+*Items:* {len(items)}
+
+Select download option:
+"""
+    
+    await update.message.reply_text(
+        caption,
+        reply_markup=InlineKeyboardMarkup(keyboard),
+        parse_mode=ParseMode.MARKDOWN
+    )
+
 async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle button callbacks."""
     query = update.callback_query
-    await query.answer()
-    
     data = query.data
     if data.startswith("format_"):
-        parts = data.split("_")
-        url = parts[1]
-        format_type = parts[2]
-        
-        user_id = query.from_user.id
-        user_data[user_id] = {
-            'url': url,
-            'format': format_type,
-            'message': query.message
-        }
+        token = data[len("format_"):]
+        # In groups everyone sees the menu; it stays for the one who sent the link
+        choice = choices.get(token)
+        if choice is not None and choice.user_id != query.from_user.id:
+            await query.answer("These buttons are for whoever sent the link.", show_alert=True)
+            return
+        await query.answer()
+        choice = choices.pop(token)
+        if choice is None:
+            await query.edit_message_text("Session expired. Please send the URL again.")
+            return
         
         # Start download
-        await download_video(update, context)
-
-async def progress_hook(d, update, context):
-    """Progress hook for download."""
-    if d['status'] == 'downloading':
-        percent = d.get('_percent_str', '0%').strip()
-        speed = d.get('_speed_str', 'N/A')
-        eta = d.get('_eta_str', 'N/A')
-        
-        # Update progress message
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.effective_message.message_id + 1,
-                text=f"⬇️ Downloading...\nProgress: {percent}\nSpeed: {speed}\nETA: {eta}"
-            )
-        except:
-            pass
-            
-    elif d['status'] == 'finished':
-        try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.effective_message.message_id + 1,
-                text="✅ Download complete!\n⏫ Uploading to Telegram..."
-            )
-        except:
-            pass
+        await download_video(update, context, choice)
+    else:
+        await query.answer()
 
-async def download_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Download and send video."""
-    query = update.callback_query
-    user_id = query.from_user.id
+async def send_file_id(bot, chat_id, kind, file_id):
+    """Send a file Telegram already has, by its file_id."""
+    caption = AUDIO_CAPTION if kind == 'audio' else VIDEO_CAPTION
+    return await getattr(bot, f"send_{kind}")(chat_id=chat_id, caption=caption, **{kind: file_id})
+
+async def send_cached(bot, chat_id, key):
+    """Resend an earlier upload by its file_id, returns True on success."""
+    entry = file_index.get(key)
+    if entry is None:
+        return False
     
-    if user_id not in user_data:
-        await query.edit_message_text("Session expired. Please send the URL again.")
-        return
+    try:
+        await send_file_id(bot, chat_id, *entry)
+    except BadRequest as e:
+        logger.warning(f"Cached file_id for {key} rejected: {e}")
+        file_index.forget(key)
+        return False
+    return True
+
+def media_of(message):
+    """Return (kind, file_id) of the file attached to a sent message."""
+    for kind in ('audio', 'video', 'animation', 'document'):
+        media = getattr(message, kind)
+        if media is not None:
+            return kind, media.file_id
+    return None, None
+
+def format_spec(format_type):
+    """yt-dlp format spec for a format button."""
+    if format_type == 'audio':
+        # Prefer audio that can be sent without re-encoding
+        preferred = [f"bestaudio[acodec^={codec}]" for codec in AUDIO_PASSTHROUGH]
+        return '/'.join(preferred + ['bestaudio', 'best'])
+    elif format_type.startswith('video'):
+        # Specific video format, or a video+audio merge
+        return format_type.split('_', 1)[1]
+    # Best single file that is not known to exceed the upload limit
+    return f"best[filesize<?{UPLOAD_LIMIT}][filesize_approx<?{UPLOAD_LIMIT}]"
+
+def estimate_bytes(info, format_type):
+    """Disk space a temp-file download needs: the streams fetched plus any output made from them.
     
-    data = user_data[user_id]
-    url = data['url']
-    format_type = data['format']
+    Falls back to the upload limit when sizes are unknown, and never asks
+    for more than twice that.
+    """
+    estimate = None
+    if info is not None:
+        duration = info.get('duration')
+        formats = {f.get('format_id'): f for f in info.get('formats') or []}
+        if format_type == 'audio':
+            source = pick_audio(list(formats.values()))
+            size = estimate_size(source, duration) if source else None
+            if size:
+                estimate = size + (audio_size(duration, AUDIO_BITRATE) or size)
+        elif format_type.startswith('video'):
+            sizes = [estimate_size(formats[i], duration) if i in formats else None
+                     for i in format_spec(format_type).split('+')]
+            if sizes and None not in sizes:
+                # A merge writes the output next to its inputs
+                estimate = sum(sizes) * (2 if len(sizes) > 1 else 1)
+        else:
+            # The single file format_spec('best') settles on: the last one not known to be too large
+            fits = [f for f in formats.values() if has_video(f) and has_audio(f)
+                    and (f.get('filesize') or 0) < UPLOAD_LIMIT and (f.get('filesize_approx') or 0) < UPLOAD_LIMIT]
+            if fits:
+                estimate = estimate_size(fits[-1], duration)
+    return min(estimate or UPLOAD_LIMIT, 2 * UPLOAD_LIMIT)
+
+def resource_for(format_type):
+    """Scheduler slot class: merges are CPU bound, the rest network bound.
     
-    await query.edit_message_text("⏳ Processing your request...")
+    Audio conversion happens in the transcoder, which has its own limit.
+    """
+    if '+' in format_spec(format_type):
+        return 'cpu'
+    return 'network'
+
+async def stream_video(bot, chat_id, url, format_type, job, reporter):
+    """Pipe a single-file format from yt-dlp straight into send_video.
     
-    # Create progress message
-    progress_msg = await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="🔄 Starting download..."
-    )
+    Returns the sent message, or None when the format needs the temp-file path.
+    """
+    info = await get_info(url)
+    fmt = await executor.run(select_stream_format, info, format_spec(format_type), timeout=INFO_TIMEOUT)
+    if fmt is None:
+        return None
+    if (fmt.get('filesize') or 0) > UPLOAD_LIMIT:
+        raise FileTooLarge(f"{fmt['filesize']} bytes")
     
+    await reporter.show("⬇️ Streaming to Telegram...")
+    title = yt_dlp.utils.sanitize_filename(info.get('title', 'video')).replace('"', '')
+    extractor = info.get('extractor_key')
+    pipe = await MediaPipe(info, fmt, STREAM_BUFFER_CHUNKS, job, reporter.hook, UPLOAD_LIMIT).start()
     try:
-        # Create temp directory
-        with tempfile.TemporaryDirectory() as tmpdir:
-            ydl_opts = {
-                'outtmpl': os.path.join(tmpdir, '%(title)s.%(ext)s'),
-                'progress_hooks': [lambda d: asyncio.create_task(progress_hook(d, update, context))],
-                'quiet': True,
-            }
-            
-            if format_type == 'audio':
-                # Audio only download
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-                await progress_msg.edit_text("🎵 Extracting audio...")
-                
-            elif format_type == 'best':
-                # Best quality
-                ydl_opts['format'] = 'best'
-                
-            elif format_type.startswith('video'):
-                # Specific video format
-                format_id = format_type.split('_')[1]
-                ydl_opts['format'] = format_id
-            
-            # Download
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                # Adjust filename for audio
-                if format_type == 'audio':
-                    filename = os.path.splitext(filename)[0] + '.mp3'
-            
-            # Send file
-            await progress_msg.edit_text("📤 Uploading to Telegram...")
-            
-            with open(filename, 'rb') as file:
-                if format_type == 'audio':
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=file,
-                        title=info.get('title', 'Audio'),
-                        performer=info.get('uploader', 'Unknown'),
-                        caption="🎵 Converted to audio by Video Downloader Bot"
-                    )
-                else:
-                    await context.bot.send_video(
-                        chat_id=update.effective_chat.id,
-                        video=file,
-                        caption="📹 Downloaded by Video Downloader Bot",
-                        supports_streaming=True
-                    )
-            
-            # Cleanup
-            await progress_msg.delete()
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="✅ Done! Send another URL or use /start"
+        with phase_seconds.time(phase='stream', extractor=extractor):
+            sent = await stream_upload(
+                bot, upload_http, 'sendVideo', 'video', f"{title}.{fmt.get('ext', 'mp4')}", pipe.chunks(),
+                chat_id=chat_id,
+                caption=VIDEO_CAPTION,
+                supports_streaming=True,
             )
-            
-    except Exception as e:
-        logger.error(f"Download error: {e}")
-        await progress_msg.edit_text(f"❌ Error: {str(e)}")
-    
+        bytes_in.inc(pipe.received, extractor=extractor)
+        bytes_out.inc(pipe.received, extractor=extractor)
+        return sent
+    except RetryAfter:
+        api_throttled.inc(method='sendVideo')
+        raise
+    except StreamFailed as e:
+        logger.warning(f"Streaming {url} failed, falling back to temp file: {e}")
+        return None
     finally:
-        # Clean user data
-        if user_id in user_data:
-            del user_data[user_id]
+        pipe.kill()
 
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Log errors."""
-    logger.error(f"Update {update} caused error {context.error}")
-
-def main():
-    """Start the bot."""
-    # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+async def deliver(bot, chat_id, user_id, url, format_type, key, flight):
+    """Download url once and upload it to chat_id, returns (kind, file_id).
     
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("help", help_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
-    application.add_handler(CallbackQueryHandler(button_callback))
-    application.add_error_handler(error_handler)
+    Runs as the shared task of a flight; progress goes to every subscriber.
+    Users cancel their part by leaving the flight, which cancels this task
+    once nobody is left; the job itself belongs to no user.
+    """
+    job = Job(f"download:{url}")
+    reporter = ProgressReporter(flight.subscribers, edit_budget, PROGRESS_INTERVAL).start()
     
-    # Start the bot
-    if WEBHOOK_URL:
-        # Webhook mode for production
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=BOT_TOKEN,
-            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}"
-        )
-    else:
-        # Polling mode for development
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+    async def show_position(position):
+        await reporter.show(f"⏳ Waiting for a free slot...\nPosition in queue: {position}")
+    
+    # Shutdown reaches the job while it streams or converts, not only while it downloads
+    try:
+        with executor.track(job):
+            async with scheduler.slot(user_id, resource_for(format_type), on_position=show_position):
+                sent = None
+                # A local Bot API server takes a file path, which beats streaming bytes
+                if STREAM_UPLOADS and not LOCAL_MODE and format_type != 'audio':
+                    sent = await stream_video(bot, chat_id, url, format_type, job, reporter)
+                if sent is None:
+                    sent = await download_and_upload(bot, chat_id, url, format_type, job, reporter)
+    finally:
+        await reporter.stop()
+    
+    kind, file_id = media_of(sent)
+    if key is not None and file_id is not None:
+        file_index.put(key, kind, file_id)
+    return kind, file_id
 
-if __name__ == '__main__':
-    main()                    [InlineKeyboardButton("🎬 Video", callback_data=f"video:{url}")],
-                    [InlineKeyboardButton("🎵 Audio Only", callback_data=f"audio:{url}")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await msg.edit_text(
-                    f"Found video!\n\n"
-                    f"Title: {info.get('title', 'Unknown')}\n"
-                    f"Duration: {info.get('duration', 0)} seconds\n"
-                    f"Uploader: {info.get('uploader', 'Unknown')}\n\n"
-                    f"Select download type:",
-                    reply_markup=reply_markup
-                )
-                
-        except Exception as e:
-            await msg.edit_text(f"Error: {str(e)}")
+async def download_file(url, format_type, job, reporter, tmpdir):
+    """Download url into tmpdir, converting audio; returns (info, filename)."""
+    ydl_opts = {
+        'outtmpl': os.path.join(tmpdir, '%(title)s.%(ext)s'),
+        'progress_hooks': [job.check] + ([reporter.hook] if reporter else []),
+        'format': format_spec(format_type),
+    }
+    # Parallel fragments / ranged connections, tuned per site
+    cached = metadata_cache.get(url)
+    ydl_opts.update(download_options(cached.get('extractor_key') if cached else None))
     
-    async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        query = update.callback_query
-        await query.answer()
-        
-        data = query.data
-        
-        if data.startswith("video:"):
-            url = data.split(":", 1)[1]
-            await self.download_video(query, url)
-        
-        elif data.startswith("audio:"):
-            url = data.split(":", 1)[1]
-            await self.download_audio(query, url)
+    # Download
+    with phase_seconds.time(phase='download') as labels:
+        info, filename = await executor.run(fetch_media, url, ydl_opts, job=job)
+        labels['extractor'] = extractor = info.get('extractor_key')
+    bytes_in.inc(os.path.getsize(filename), extractor=extractor)
     
-    async def download_video(self, query, url: str):
-        msg = await query.message.reply_text("Downloading video...")
-        
-        try:
-            ydl_opts = {
-                'format': 'best[filesize<50M]',
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'quiet': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                if os.path.exists(filename):
-                    file_size = os.path.getsize(filename)
-                    
-                    if file_size > 50 * 1024 * 1024:
-                        os.remove(filename)
-                        await msg.edit_text("File too large (>50MB). Try shorter video.")
-                        return
-                    
-                    await msg.edit_text("Uploading...")
-                    
-                    with open(filename, 'rb') as f:
-                        await query.message.reply_video(
-                            video=f,
-                            caption=f"{info.get('title', 'Video')}",
-                            supports_streaming=True
-                        )
-                    
-                    await msg.delete()
-                    os.remove(filename)
-                else:
-                    await msg.edit_text("Download failed. File not created.")
-                    
-        except Exception as e:
-            await msg.edit_text(f"Error: {str(e)}")
+    if format_type == 'audio':
+        if reporter:
+            await reporter.show("🎵 Extracting audio...")
+        with phase_seconds.time(phase='postprocess', extractor=extractor):
+            filename, cpu = await transcoder.audio(filename, info.get('acodec'), audio_preset, job)
+        transcode_cpu.inc(cpu)
     
-    async def download_audio(self, query, url: str):
-        msg = await query.message.reply_text("Extracting audio...")
+    file_size = os.path.getsize(filename)
+    if file_size > UPLOAD_LIMIT:
+        raise FileTooLarge(f"{file_size} bytes")
+    return info, filename
+
+async def download_and_upload(bot, chat_id, url, format_type, job, reporter):
+    """Download into a temp directory, then upload the file; returns the sent message."""
+    async def show_wait():
+        await reporter.show("💾 Waiting for disk space...")
+    
+    # Own directory for this job, within the disk budget
+    needed = estimate_bytes(metadata_cache.get(url), format_type)
+    async with scratch.reserve(needed, on_wait=show_wait) as tmpdir:
+        info, filename = await download_file(url, format_type, job, reporter, tmpdir)
         
-        try:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'quiet': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                filename = filename.rsplit('.', 1)[0] + '.mp3'
-                
-                if os.path.exists(filename):
-                    await msg.edit_text("Uploading audio...")
-                    
-                    with open(filename, 'rb') as f:
-                        await query.message.reply_audio(
-                            audio=f,
-                            caption=f"{info.get('title', 'Audio')}"
-                        )
-                    
-                    await msg.delete()
-                    os.remove(filename)
-                else:
-                    await msg.edit_text("Audio extraction failed")
-                    
-        except Exception as e:
-            await msg.edit_text(f"Error: {str(e)}")
+        # Send file
+        await reporter.show("📤 Uploading to Telegram...")
+        
+        extractor = info.get('extractor_key')
+        bytes_out.inc(os.path.getsize(filename), extractor=extractor)
+        with phase_seconds.time(phase='upload', extractor=extractor):
+            if LOCAL_MODE:
+                # Hands the server a file:// path instead of uploading the bytes
+                return await send_file(bot, chat_id, format_type, Path(filename), info)
+            with open(filename, 'rb') as file:
+                return await send_file(bot, chat_id, format_type, file, info)
 
-def main():
-    print("Starting Video Downloader Bot...")
+async def send_file(bot, chat_id, format_type, media, info):
+    """Upload a downloaded file as audio or video."""
+    if format_type == 'audio':
+        return await bot.send_audio(
+            chat_id=chat_id,
+            audio=media,
+            title=info.get('title', 'Audio'),
+            performer=info.get('uploader', 'Unknown'),
+            caption=AUDIO_CAPTION,
+            read_timeout=UPLOAD_TIMEOUT,
+            write_timeout=UPLOAD_TIMEOUT
+        )
+    else:
+        return await bot.send_video(
+            chat_id=chat_id,
+            video=media,
+            caption=VIDEO_CAPTION,
+            supports_streaming=True,
+            read_timeout=UPLOAD_TIMEOUT,
+            write_timeout=UPLOAD_TIMEOUT
+        )
+
+async def download_video(update: Update, context: ContextTypes.DEFAULT_TYPE, choice):
+    """Queue the chosen download for a worker."""
+    query = update.callback_query
+    user_id = query.from_user.id
     
-    if not BOT_TOKEN:
-        print("ERROR: Set BOT_TOKEN in Railway Variables!")
+    if not scheduler.admit(user_id):
+        await query.edit_message_text("🐢 You're sending requests too fast. Please wait a minute.")
         return
     
-    print(f"Token: {BOT_TOKEN[:10]}...")
-    
-    application = Application.builder().token(BOT_TOKEN).build()
+    # Once the job is in the database the update itself may be forgotten
+    jobs.submit(user_id, choice.chat_id, choice.url, choice.format_type)
+    jobs.ack_update(update.update_id)
+    job_ready.set()
     
-    bot = VideoBot()
+    await query.edit_message_text("⏳ Processing your request...")
+
+async def run_job(bot, job):
+    """Download and send the file for a recorded job, retrying transient failures."""
+    user_id, chat_id, url, format_type = job.user_id, job.chat_id, job.url, job.format_type
+    if format_type.startswith('batch_'):
+        return await run_batch(bot, job)
     
-    application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(CommandHandler("help", bot.help))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_url))
-    application.add_handler(CallbackQueryHandler(bot.button_handler))
+    # Skip the download entirely if Telegram already has this file
+    key = None
+    refused = None
+    try:
+        info = await get_info(url)
+        key = content_key(info, format_type)
+        if await send_cached(bot, chat_id, key):
+            jobs.finish(job.id)
+            job_outcomes.inc(outcome='cached')
+            return
+    except (CircuitOpen, KnownFailure) as e:
+        refused = e
+    except Exception as e:
+        logger.warning(f"File index lookup failed for {url}: {e}")
     
-    print("Bot is ready!")
-    application.run_polling(drop_pending_updates=True)
-
-if __name__ == '__main__':
-    main()                
-                # Send info
-                await msg.edit_text(
-                    f"📹 *Found!*\n\n"
-                    f"**Title:** {info.get('title', 'Unknown')}\n"
-                    f"**Duration:** {info.get('duration', 0)}s\n"
-                    f"**Uploader:** {info.get('uploader', 'Unknown')}\n\n"
-                    f"Select download type:",
-                    reply_markup=reply_markup,
-                    parse_mode='Markdown'
-                )
-                
-        except Exception as e:
-            await msg.edit_text(f"❌ Error: {str(e)}")
+    # Create progress message
+    progress_msg = await bot.send_message(
+        chat_id=chat_id,
+        text="🔄 Starting download..." if job.attempts == 1 else "🔁 Retrying your download..."
+    )
     
-    async def button_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Handle button clicks"""
-        query = update.callback_query
-        await query.answer()
-        
-        data = query.data
+    try:
+        if refused is not None:
+            raise refused
+        # Identical requests already in flight share one download and upload;
+        # cancelling this job only takes it out of the shared one
+        waiter = Job(f"job:{job.id}", owner=user_id, record=job.id)
+        with executor.track(waiter):
+            (kind, file_id), leader = await downloads.run(
+                (canonical_url(url), format_type),
+                lambda flight: deliver(bot, chat_id, user_id, url, format_type, key, flight),
+                subscriber=progress_msg,
+                job=waiter,
+            )
+        if not leader:
+            await send_file_id(bot, chat_id, kind, file_id)
+        jobs.finish(job.id)
+        job_outcomes.inc(outcome='done')
         
-        if data.startswith("video:"):
-            url = data.split(":", 1)[1]
-            await self.download_video(query, url)
+        # Cleanup
+        await progress_msg.delete()
+        await bot.send_message(
+            chat_id=chat_id,
+            text="✅ Done! Send another URL or use /start"
+        )
+        return
         
-        elif data.startswith("audio:"):
-            url = data.split(":", 1)[1]
-            await self.download_audio(query, url)
+    except Busy as e:
+        error = e
+        text = "⚠️ You already have too many downloads queued. Wait for them to finish."
+    except FileTooLarge as e:
+        error = e
+        limit_mb = UPLOAD_LIMIT // (1024 * 1024)
+        text = f"❌ File too large (>{limit_mb}MB). Try a lower quality or shorter video."
+    except yt_dlp.utils.DownloadCancelled as e:
+        error = e
+        text = "🛑 Download cancelled."
+    except Exception as e:
+        error = e
+        logger.error(f"Download error: {e}")
+        if isinstance(e, CircuitOpen):
+            text = f"⏳ {e.key} isn't answering right now, so I'm holding off."
+        elif isinstance(e, KnownFailure):
+            text = f"❌ This video can't be downloaded: {e}"
+        elif isinstance(e, asyncio.TimeoutError):
+            text = "⌛ Download timed out. Try a shorter video or lower quality."
+        elif isinstance(e, NoSpace):
+            text = "💾 Not enough disk space right now."
+        else:
+            text = f"❌ Error: {str(e)}"
+        delay = jobs.retry(job, e) if is_transient(e) else None
+        if delay is not None:
+            job_outcomes.inc(outcome='retry')
+            await progress_msg.edit_text(f"{text}\n🔁 Retrying in {delay}s...")
+            return
     
-    async def download_video(self, query, url: str):
-        """Download video"""
-        msg = await query.message.reply_text("⏬ Downloading video...")
-        
-        try:
-            ydl_opts = {
-                'format': 'best[filesize<50M]',  # Limit to 50MB for Telegram
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'quiet': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                # Check file size
-                if os.path.exists(filename):
-                    file_size = os.path.getsize(filename)
-                    
-                    if file_size > 50 * 1024 * 1024:  # 50MB
-                        os.remove(filename)
-                        await msg.edit_text("❌ File too large (>50MB). Try shorter video.")
-                        return
-                    
-                    await msg.edit_text("📤 Uploading...")
-                    
-                    # Send video
-                    with open(filename, 'rb') as f:
-                        await query.message.reply_video(
-                            video=f,
-                            caption=f"✅ {info.get('title', 'Video')}",
-                            supports_streaming=True
-                        )
-                    
-                    await msg.delete()
-                    os.remove(filename)
-                else:
-                    await msg.edit_text("❌ Download failed. File not created.")
-                    
-        except Exception as e:
-            await msg.edit_text(f"❌ Error: {str(e)}")
+    jobs.fail(job.id, error)
+    job_outcomes.inc(outcome='cancelled' if isinstance(error, yt_dlp.utils.DownloadCancelled) else 'failed')
+    await progress_msg.edit_text(text)
+
+async def fetch_batch_item(user_id, job_id, url, format_type):
+    """Get one batch item ready to send, returns (info, key, file_id, filename).
     
-    async def download_audio(self, query, url: str):
-        """Download audio"""
-        msg = await query.message.reply_text("🎵 Extracting audio...")
+    file_id is set instead of filename when Telegram already has the file.
+    """
+    job = Job(f"batch:{url}", owner=user_id, record=job_id)
+    with executor.track(job):
+        info = await get_info(url, job=job)
+        if 'entries' in info:
+            raise ValueError("playlists inside a batch are not supported")
+        
+        key = content_key(info, format_type)
+        entry = file_index.get(key)
+        if entry is not None and entry[0] == ('audio' if format_type == 'audio' else 'video'):
+            return info, key, entry[1], None
         
+        # The directory stays reserved until the item's album is sent
+        workdir = await scratch.acquire(estimate_bytes(info, format_type))
         try:
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
-                }],
-                'outtmpl': 'downloads/%(title)s.%(ext)s',
-                'quiet': True,
-            }
-            
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                filename = filename.rsplit('.', 1)[0] + '.mp3'
-                
-                if os.path.exists(filename):
-                    await msg.edit_text("📤 Uploading audio...")
-                    
-                    with open(filename, 'rb') as f:
-                        await query.message.reply_audio(
-                            audio=f,
-                            caption=f"🎵 {info.get('title', 'Audio')}"
-                        )
-                    
-                    await msg.delete()
-                    os.remove(filename)
-                else:
-                    await msg.edit_text("❌ Audio extraction failed")
-                    
-        except Exception as e:
-            await msg.edit_text(f"❌ Error: {str(e)}")
+            async with scheduler.slot(user_id, resource_for(format_type)):
+                info, filename = await download_file(url, format_type, job, None, workdir)
+            # Items waiting for their album hold only what they use, or they
+            # could keep the album's other items from getting space at all
+            await scratch.shrink(workdir, os.path.getsize(filename))
+        except BaseException:
+            await scratch.release(workdir)
+            raise
+        return info, key, None, filename
 
-def main():
-    """Start bot - FIXED for Railway"""
-    print("🚀 Starting Video Downloader Bot...")
-    print(f"✅ Token: {BOT_TOKEN[:10]}...")
-    
-    # Create application with persistence disabled
-    application = Application.builder().token(BOT_TOKEN).build()
-    
-    # Initialize bot
-    bot = WorkingBot()
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_url))
-    application.add_handler(CallbackQueryHandler(bot.button_handler))
-    
-    # Start bot with proper settings for Railway
-    print("🤖 Bot is ready on Railway!")
-    application.run_polling(
-        drop_pending_updates=True,
-        close_loop=False  # Important for Railway
-    )
-
-if __name__ == '__main__':
-    main()    • Progress indicators
-    • Support for 1000+ sites
+async def send_album(bot, chat_id, format_type, items):
+    """Send fetched batch items as albums, deleting their files; returns how many were sent."""
+    def request_bytes(item):
+        # Only files uploaded in the request body count, not file_ids or local paths
+        filename = item[3]
+        return os.path.getsize(filename) if filename and not LOCAL_MODE else 0
     
-    *Note:* Some sites may have restrictions.
-    """
-    await update.message.reply_text(help_text, parse_mode=ParseMode.MARKDOWN)
+    sent = 0
+    for album in pack_albums(items, request_bytes, ALBUM_MAX_BYTES, ALBUM_SIZE):
+        extractor = album[0][0].get('extractor_key')
+        for _, _, _, filename in album:
+            if filename:
+                bytes_out.inc(os.path.getsize(filename), extractor=extractor)
+        with contextlib.ExitStack() as files, phase_seconds.time(phase='upload', extractor=extractor):
+            sources = [
+                file_id or (Path(filename) if LOCAL_MODE else files.enter_context(open(filename, 'rb')))
+                for _, _, file_id, filename in album
+            ]
+            if len(album) == 1:
+                messages = [await send_file(bot, chat_id, format_type, sources[0], album[0][0])]
+            else:
+                caption = AUDIO_CAPTION if format_type == 'audio' else VIDEO_CAPTION
+                media = [
+                    InputMediaAudio(source, title=info.get('title'), performer=info.get('uploader'),
+                                    caption=caption if i == 0 else None)
+                    if format_type == 'audio' else
+                    InputMediaVideo(source, supports_streaming=True, caption=caption if i == 0 else None)
+                    for i, (source, (info, _, _, _)) in enumerate(zip(sources, album))
+                ]
+                messages = await bot.send_media_group(
+                    chat_id=chat_id,
+                    media=media,
+                    read_timeout=UPLOAD_TIMEOUT,
+                    write_timeout=UPLOAD_TIMEOUT
+                )
+        
+        for (_, key, file_id, filename), message in zip(album, messages):
+            if filename:
+                await scratch.release(os.path.dirname(filename))
+                kind, new_id = media_of(message)
+                if new_id is not None:
+                    file_index.put(key, kind, new_id)
+        sent += len(album)
+    return sent
 
-async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle incoming messages containing URLs."""
-    message_text = update.message.text
+async def run_batch(bot, job):
+    """Download a batch of links and send them as albums.
     
-    # Check if message contains URL
-    url_pattern = r'https?://(?:[-\w.]|(?:%[\da-fA-F]{2}))+[/\w .\-?=&%]*'
-    urls = re.findall(url_pattern, message_text)
+    Items are fetched BATCH_CONCURRENCY at a time, and while one album
+    uploads the items of the next are already being extracted, downloaded
+    and converted. Failed items are listed at the end.
+    """
+    urls = json.loads(job.url)
+    format_type = 'audio' if job.format_type == 'batch_audio' else 'best'
+    status = await bot.send_message(chat_id=job.chat_id, text=f"📚 Downloading {len(urls)} items...")
+    gate = asyncio.Semaphore(BATCH_CONCURRENCY)
+    failed = []
+    workdirs = []
+    sent = 0
     
-    if not urls:
-        await update.message.reply_text("Please send me a valid video URL!")
-        return
+    async def fetch(url):
+        async with gate:
+            try:
+                item = await fetch_batch_item(job.user_id, job.id, url, format_type)
+            except yt_dlp.utils.DownloadCancelled:
+                raise
+            except Exception as e:
+                logger.warning(f"Batch item {url} failed: {e}")
+                failed.append((url, e))
+                return None
+        if item[3]:
+            workdirs.append(os.path.dirname(item[3]))
+        return item
     
-    url = urls[0]
+    def prefetch(start):
+        if start >= len(urls):
+            return None
+        return asyncio.gather(*(fetch(url) for url in urls[start:start + ALBUM_SIZE]))
     
-    # Get video info
+    pending = prefetch(0)
     try:
-        await update.message.reply_text("🔍 Fetching video information...")
-        
-        ydl_opts = {'quiet': True}
-        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            # Check if it's a playlist
-            if 'entries' in info:
-                await update.message.reply_text("⚠️ Playlists are not supported. Please send a single video URL.")
-                return
-            
-            # Create quality/format selection keyboard
-            keyboard = []
-            
-            # Audio only option
-            keyboard.append([InlineKeyboardButton("🎵 Audio Only (MP3)", callback_data=f"format_{url}_audio")])
-            
-            # Video quality options
-            if 'formats' in info:
-                formats = info['formats']
-                # Filter video formats
-                video_formats = [f for f in formats if f.get('vcodec') != 'none' and f.get('acodec') != 'none']
-                
-                # Get unique resolutions
-                resolutions = {}
-                for fmt in video_formats:
-                    res = fmt.get('resolution', 'N/A')
-                    if res != 'N/A' and res not in resolutions:
-                        resolutions[res] = fmt
-                
-                # Add quality options (limit to 5)
-                for i, (res, fmt) in enumerate(list(resolutions.items())[:5]):
-                    keyboard.append([
-                        InlineKeyboardButton(f"📹 Video {res}", 
-                         callback_data=f"format_{url}_video_{fmt['format_id']}")
-                    ])
-            
-            # Add best quality option
-            keyboard.append([
-                InlineKeyboardButton("🏆 Best Quality", 
-                 callback_data=f"format_{url}_best")
-            ])
-            
-            reply_markup = InlineKeyboardMarkup(keyboard)
-            
-            # Send video info with options
-            title = info.get('title', 'Unknown Title')
-            duration = info.get('duration', 0)
-            duration_str = f"{duration//60}:{duration%60:02d}" if duration else "Unknown"
-            
-            caption = f"""
-            *📹 Video Found!*
-            
-            *Title:* {title}
-            *Duration:* {duration_str}
-            
-            Select download option:
-            """
-            
-            await update.message.reply_text(
-                caption,
-                reply_markup=reply_markup,
-                parse_mode=ParseMode.MARKDOWN
-            )
-            
+        for start in range(0, len(urls), ALBUM_SIZE):
+            items = [item for item in await pending if item is not None]
+            pending = prefetch(start + ALBUM_SIZE)
+            sent += await send_album(bot, job.chat_id, format_type, items)
+            if pending is not None:
+                await status.edit_text(f"📚 Sent {sent} of {len(urls)} items...")
+    except yt_dlp.utils.DownloadCancelled as e:
+        jobs.fail(job.id, e)
+        job_outcomes.inc(outcome='cancelled')
+        await status.edit_text(f"🛑 Batch cancelled after {sent} of {len(urls)} items.")
+        return
     except Exception as e:
-        logger.error(f"Error fetching video info: {e}")
-        await update.message.reply_text(f"❌ Error: {str(e)}")
+        logger.error(f"Batch error: {e}")
+        jobs.fail(job.id, e)
+        job_outcomes.inc(outcome='failed')
+        await status.edit_text(f"❌ Batch stopped after {sent} of {len(urls)} items: {str(e)}")
+        return
+    finally:
+        if pending is not None:
+            pending.cancel()
+        # Files of items that were never sent
+        for path in workdirs:
+            await scratch.release(path)
 
-async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle button callbacks."""
-    query = update.callback_query
-    await query.answer()
-    
-    data = query.data
-    if data.startswith("format_"):
-        parts = data.split("_")
-        url = parts[1]
-        format_type = parts[2]
-        
-        user_id = query.from_user.id
-        user_data[user_id] = {
-            'url': url,
-            'format': format_type,
-            'message': query.message
-        }
+    jobs.finish(job.id)
+    job_outcomes.inc(outcome='done')
+    text = f"✅ Batch done: {sent} of {len(urls)} items sent."
+    if failed:
+        text += "\n\n❌ Failed:\n" + "\n".join(f"• {url}: {str(e)[:100]}" for url, e in failed[:10])
+    await status.edit_text(text)
+
+async def work(bot):
+    """Claim due jobs from the broker and run them, WORKER_JOBS at a time."""
+    while True:
+        scratch.sweep()
+        requeued = jobs.requeue_expired()
+        if requeued:
+            logger.info(f"Requeued {requeued} job(s) of workers that stopped or crashed")
+        # Only jobs whose task still runs keep their lease. Of those flagged,
+        # cancel the job's own work; the user may have started new lookups since
+        for job_id, _ in jobs.renew(WORKER_ID, JOB_LEASE, running):
+            executor.cancel_record(job_id)
         
-        # Start download
-        await download_video(update, context)
-
-async def progress_hook(d, update, context):
-    """Progress hook for download."""
-    if d['status'] == 'downloading':
-        percent = d.get('_percent_str', '0%').strip()
-        speed = d.get('_speed_str', 'N/A')
-        eta = d.get('_eta_str', 'N/A')
+        # Cleared before claiming so a job queued meanwhile still wakes us up
+        job_ready.clear()
+        # No more per user than the scheduler runs or lets wait, so the rest
+        # stay in the broker where other users' jobs can pass them
+        for job in jobs.claim(WORKER_ID, WORKER_JOBS - len(running), JOB_LEASE, USER_MAX_JOBS + USER_MAX_QUEUED):
+            task = asyncio.create_task(run_job(bot, job))
+            running[job.id] = task
+            task.add_done_callback(lambda task, job_id=job.id: job_done(job_id, task))
         
-        # Update progress message
         try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.effective_message.message_id + 1,
-                text=f"⬇️ Downloading...\nProgress: {percent}\nSpeed: {speed}\nETA: {eta}"
-            )
-        except:
+            await asyncio.wait_for(job_ready.wait(), WORKER_POLL)
+        except asyncio.TimeoutError:
             pass
-            
-    elif d['status'] == 'finished':
+
+def job_done(job_id, task):
+    """Free the job's place in this worker and look for more work."""
+    running.pop(job_id, None)
+    job_ready.set()
+    if not task.cancelled() and task.exception() is not None:
+        # The job stays claimed and is retried once its lease runs out
+        logger.error(f"Job {job_id} crashed: {task.exception()}")
+
+async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Cancel the user's queued and running downloads."""
+    user_id = update.effective_user.id
+    # Workers elsewhere see the flag on their next lease renewal
+    cancelled = max(jobs.cancel(user_id), executor.cancel(user_id))
+    if cancelled:
+        await update.message.reply_text(f"🛑 Cancelling {cancelled} running job(s)...")
+    else:
+        await update.message.reply_text("Nothing to cancel.")
+
+async def acknowledge(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Take the update out of the durable inbox (runs after all other handlers, matched or not)."""
+    jobs.ack_update(update.update_id)
+    in_flight.done(update.update_id)
+    boot_stage('first_response')
+
+async def observe_wait(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Record how long an update waited in the queue (runs before all other handlers)."""
+    received = ingested.pop(update.update_id, None)
+    if received is not None:
+        update_wait.observe(time.monotonic() - received)
+
+async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Log errors."""
+    logger.error(f"Update {update} caused error {context.error}")
+
+async def warm_up():
+    """Import yt-dlp, build the pool's YoutubeDL instances and the triage index off the event loop."""
+    try:
+        await asyncio.to_thread(ydl_pool.warm, DOWNLOAD_WORKERS)
+        await asyncio.to_thread(link_triage.build)
+    except Exception as e:
+        logger.warning(f"yt-dlp warm-up failed: {e}")
+    else:
+        boot_stage('yt_dlp')
+
+async def startup(application: Application):
+    """Replay updates that were never handled and start the worker loop.
+    
+    yt-dlp is warmed up in the background, so light commands like /start
+    are answered while it loads.
+    """
+    global worker_task, warmup_task, replay_task, metrics_server
+    warmup_task = asyncio.create_task(warm_up())
+    if METRICS_PORT:
+        metrics_server = await serve(registry, port=METRICS_PORT)
+        logger.info(f"Serving metrics on port {METRICS_PORT}")
+    if ROLE != 'worker':
+        # The queue is bounded and only drains once the application is started
+        replay_task = asyncio.create_task(replay_updates(application))
+    if ROLE != 'frontend':
+        scratch.sweep(force=True)
+        worker_task = asyncio.create_task(work(application.bot))
+    boot_stage('ready')
+
+async def shutdown(application: Application):
+    """Release the download pool and upload client on shutdown."""
+    if worker_task is not None:
+        worker_task.cancel()
+    if metrics_server is not None:
+        metrics_server.close()
+    executor.shutdown()
+    ydl_pool.close()
+    await upload_http.aclose()
+
+async def replay_updates(application: Application):
+    """Queue the updates from the durable inbox that were never handled."""
+    for payload in jobs.pending_updates(REPLAY_WINDOW):
+        update = Update.de_json(json.loads(payload), application.bot)
+        await in_flight.admit(update.update_id)
+        await application.update_queue.put(update)
+
+async def poll_updates(application: Application):
+    """Long-poll getUpdates, writing each update to the job database first.
+    
+    Telegram treats updates as delivered once a later offset is requested,
+    so nothing is confirmed before it is on disk.
+    """
+    bot = application.bot
+    await bot.delete_webhook()
+    offset = None
+    while True:
         try:
-            await context.bot.edit_message_text(
-                chat_id=update.effective_chat.id,
-                message_id=update.effective_message.message_id + 1,
-                text="✅ Download complete!\n⏫ Uploading to Telegram..."
+            updates = await bot.get_updates(
+                offset=offset,
+                timeout=POLL_TIMEOUT,
+                read_timeout=POLL_TIMEOUT + 10,
+                allowed_updates=Update.ALL_TYPES,
             )
-        except:
-            pass
+        except RetryAfter as e:
+            await asyncio.sleep(e.retry_after)
+            continue
+        except NetworkError as e:
+            logger.warning(f"Polling failed: {e}")
+            await asyncio.sleep(3)
+            continue
+        
+        for update in updates:
+            if jobs.record_update(update.update_id, update.to_json()):
+                # With no room left the next getUpdates waits, the rest wait at Telegram
+                await in_flight.admit(update.update_id)
+                ingested[update.update_id] = time.monotonic()
+                await application.update_queue.put(update)
+        if updates:
+            offset = updates[-1].update_id + 1
 
-async def download_video(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Download and send video."""
-    query = update.callback_query
-    user_id = query.from_user.id
+async def serve_webhook(application: Application):
+    """Take updates from Telegram's webhook, writing each to the job database first.
     
-    if user_id not in user_data:
-        await query.edit_message_text("Session expired. Please send the URL again.")
-        return
+    Deliveries are answered as soon as the update is queued. Redeliveries
+    are dropped by update_id; a delivery that finds no room for
+    WEBHOOK_QUEUE_WAIT seconds is refused, and forgotten, so that Telegram
+    sends it again later.
+    """
+    bot = application.bot
     
-    data = user_data[user_id]
-    url = data['url']
-    format_type = data['format']
+    async def ingest(data, payload):
+        update_id = data['update_id']
+        if not jobs.record_update(update_id, payload, in_order=False):
+            return True
+        if not await in_flight.admit(update_id, WEBHOOK_QUEUE_WAIT):
+            jobs.ack_update(update_id)
+            webhook_refused.inc()
+            return False
+        ingested[update_id] = time.monotonic()
+        await application.update_queue.put(Update.de_json(data, bot))
+        return True
     
-    await query.edit_message_text("⏳ Processing your request...")
-    
-    # Create progress message
-    progress_msg = await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text="🔄 Starting download..."
+    server = WebhookServer(ingest, f"/{BOT_TOKEN}", secret=WEBHOOK_SECRET)
+    await server.start("0.0.0.0", PORT)
+    try:
+        await bot.set_webhook(
+            url=f"{WEBHOOK_URL}/{BOT_TOKEN}",
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+            allowed_updates=Update.ALL_TYPES,
+        )
+        logger.info(f"Taking webhook deliveries on port {PORT}")
+        await asyncio.Event().wait()
+    finally:
+        await server.close()
+
+def api_request():
+    """Bot API request object with uploads and control calls on separate connection pools."""
+    control = PooledRequest(
+        api_seconds, api_throttled,
+        keepalive=API_KEEPALIVE,
+        connection_pool_size=CONTROL_POOL_SIZE,
+        read_timeout=CONTROL_TIMEOUT,
+        write_timeout=CONTROL_TIMEOUT,
+        pool_timeout=CONTROL_TIMEOUT,
     )
+    media = PooledRequest(
+        api_seconds, api_throttled,
+        keepalive=API_KEEPALIVE,
+        connection_pool_size=MEDIA_POOL_SIZE,
+        read_timeout=UPLOAD_TIMEOUT,
+        write_timeout=UPLOAD_TIMEOUT,
+        connect_timeout=30,
+        pool_timeout=UPLOAD_TIMEOUT,
+    )
+    return SplitRequest(control, media)
+
+def run_application(application: Application, updater=None):
+    """Like Application.run_polling, with poll_updates or serve_webhook as the updater.
     
-    try:
-        # Create temp directory
-        with tempfile.TemporaryDirectory() as tmpdir:
-            ydl_opts = {
-                'outtmpl': os.path.join(tmpdir, '%(title)s.%(ext)s'),
-                'progress_hooks': [lambda d: asyncio.create_task(progress_hook(d, update, context))],
-                'quiet': True,
-            }
-            
-            if format_type == 'audio':
-                # Audio only download
-                ydl_opts.update({
-                    'format': 'bestaudio/best',
-                    'postprocessors': [{
-                        'key': 'FFmpegExtractAudio',
-                        'preferredcodec': 'mp3',
-                        'preferredquality': '192',
-                    }],
-                })
-                await progress_msg.edit_text("🎵 Extracting audio...")
-                
-            elif format_type == 'best':
-                # Best quality
-                ydl_opts['format'] = 'best'
-                
-            elif format_type.startswith('video'):
-                # Specific video format
-                format_id = format_type.split('_')[1]
-                ydl_opts['format'] = format_id
-            
-            # Download
-            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                info = ydl.extract_info(url, download=True)
-                filename = ydl.prepare_filename(info)
-                
-                # Adjust filename for audio
-                if format_type == 'audio':
-                    filename = os.path.splitext(filename)[0] + '.mp3'
-            
-            # Send file
-            await progress_msg.edit_text("📤 Uploading to Telegram...")
-            
-            with open(filename, 'rb') as file:
-                if format_type == 'audio':
-                    await context.bot.send_audio(
-                        chat_id=update.effective_chat.id,
-                        audio=file,
-                        title=info.get('title', 'Audio'),
-                        performer=info.get('uploader', 'Unknown'),
-                        caption="🎵 Converted to audio by Video Downloader Bot"
-                    )
-                else:
-                    await context.bot.send_video(
-                        chat_id=update.effective_chat.id,
-                        video=file,
-                        caption="📹 Downloaded by Video Downloader Bot",
-                        supports_streaming=True
-                    )
-            
-            # Cleanup
-            await progress_msg.delete()
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="✅ Done! Send another URL or use /start"
-            )
-            
-    except Exception as e:
-        logger.error(f"Download error: {e}")
-        await progress_msg.edit_text(f"❌ Error: {str(e)}")
+    Workers pass no updater: they only need the bot, not the updates.
+    """
+    loop = asyncio.get_event_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, loop.stop)
     
+    try:
+        loop.run_until_complete(application.initialize())
+        loop.run_until_complete(application.post_init(application))
+        loop.run_until_complete(application.start())
+        task = loop.create_task(updater(application)) if updater is not None else None
+        if task is not None:
+            # The updater only returns on failure; stop, and re-raise its error below
+            task.add_done_callback(lambda done: done.cancelled() or loop.stop())
+        loop.run_forever()
+        if task is not None:
+            task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                loop.run_until_complete(task)
     finally:
-        # Clean user data
-        if user_id in user_data:
-            del user_data[user_id]
-
-async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Log errors."""
-    logger.error(f"Update {update} caused error {context.error}")
+        if application.running:
+            loop.run_until_complete(application.stop())
+        loop.run_until_complete(application.shutdown())
+        loop.run_until_complete(application.post_shutdown(application))
+        loop.close()
 
 def main():
     """Start the bot."""
+    global ROLE
+    parser = argparse.ArgumentParser(description="Video Downloader Bot")
+    parser.add_argument("--role", choices=("all", "frontend", "worker"), default=ROLE,
+                        help="take updates, run downloads, or both (default: $ROLE or all)")
+    ROLE = parser.parse_args().role
+    boot_stage('imports')
+    
     # Create application
-    application = Application.builder().token(BOT_TOKEN).build()
+    builder = Application.builder().token(BOT_TOKEN).post_init(startup).post_shutdown(shutdown)
+    builder.request(api_request()).rate_limiter(outbound).concurrent_updates(UPDATE_CONCURRENCY)
+    builder.update_queue(update_queue)
+    if BOT_API_URL:
+        builder.base_url(BOT_API_URL).base_file_url(BOT_API_FILE_URL).local_mode(LOCAL_MODE)
+    application = builder.build()
+    
+    if ROLE == 'worker':
+        logger.info(f"Starting worker {WORKER_ID}")
+        run_application(application)
+        return
     
-    # Add handlers
+    # Add handlers (up to UPDATE_CONCURRENCY updates run at once, so a slow
+    # extraction never holds up other chats)
+    application.add_handler(TypeHandler(Update, observe_wait), group=-1)
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
+    application.add_handler(CommandHandler("cancel", cancel))
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
     application.add_handler(CallbackQueryHandler(button_callback))
+    # Updates no handler takes (other commands, member changes, ...) are done with too
+    application.add_handler(TypeHandler(Update, acknowledge), group=1)
     application.add_error_handler(error_handler)
     
     # Start the bot
+    # Either way, nothing is lost across restarts
     if WEBHOOK_URL:
-        # Webhook mode for production
-        application.run_webhook(
-            listen="0.0.0.0",
-            port=PORT,
-            url_path=BOT_TOKEN,
-            webhook_url=f"{WEBHOOK_URL}/{BOT_TOKEN}"
-        )
+        run_application(application, serve_webhook)
     else:
-        # Polling mode for development
-        application.run_polling(allowed_updates=Update.ALL_TYPES)
+        run_application(application, poll_updates)
 
 if __name__ == '__main__':
     main()
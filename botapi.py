@@ -0,0 +1,73 @@
+import httpx
+from telegram.request import BaseRequest
+
+from metrics import InstrumentedRequest
+
+# Bot API methods that upload media; these can hold a connection for minutes
+MEDIA_METHODS = {
+    'sendVideo', 'sendAudio', 'sendDocument', 'sendAnimation', 'sendPhoto',
+    'sendVoice', 'sendVideoNote', 'sendMediaGroup', 'sendSticker',
+}
+
+
+def file_url(api_url):
+    """The file download URL of a Bot API server, from its method URL (.../bot -> .../file/bot)."""
+    base, slash, last = api_url.rstrip('/').rpartition('/')
+    return f"{base}/file/{last}" if slash and last == 'bot' else api_url
+
+
+class PooledRequest(InstrumentedRequest):
+    """InstrumentedRequest whose idle connections stay open for `keepalive` seconds."""
+
+    def __init__(self, latency, throttled, keepalive=5.0, **kwargs):
+        self.keepalive = keepalive
+        super().__init__(latency, throttled, **kwargs)
+
+    def _build_client(self):
+        limits = self._client_kwargs['limits']
+        self._client_kwargs['limits'] = httpx.Limits(
+            max_connections=limits.max_connections,
+            max_keepalive_connections=limits.max_keepalive_connections,
+            keepalive_expiry=self.keepalive,
+        )
+        return super()._build_client()
+
+
+class SplitRequest(BaseRequest):
+    """Sends media uploads through one request object and all other calls through another.
+
+    Each side has its own connection pool and timeouts, so slow uploads
+    never hold the connections that messages, edits and callback answers
+    need. Timeouts left at their defaults are those of the chosen side.
+    """
+
+    def __init__(self, control, media, media_methods=MEDIA_METHODS):
+        self.control = control
+        self.media = media
+        self.media_methods = frozenset(media_methods)
+
+    @property
+    def read_timeout(self):
+        return self.control.read_timeout
+
+    async def initialize(self):
+        await self.control.initialize()
+        await self.media.initialize()
+
+    async def shutdown(self):
+        await self.control.shutdown()
+        await self.media.shutdown()
+
+    def route(self, url):
+        """The request object for a Bot API URL."""
+        return self.media if url.rsplit('/', 1)[-1] in self.media_methods else self.control
+
+    async def post(self, url, request_data=None, **timeouts):
+        # The chosen side applies its own defaults, e.g. for media write timeouts
+        return await self.route(url).post(url, request_data, **timeouts)
+
+    async def retrieve(self, url, **timeouts):
+        return await self.control.retrieve(url, **timeouts)
+
+    async def do_request(self, url, method, request_data=None, **timeouts):
+        return await self.route(url).do_request(url, method, request_data, **timeouts)
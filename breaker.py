@@ -0,0 +1,155 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from cache import canonical_url
+
+logger = logging.getLogger(__name__)
+
+# Errors that mean the site is pushing back or failing, whatever the video
+THROTTLED_ERRORS = re.compile(
+    r'rate.?limit|too many requests|HTTP Error (?:403|429|5\d\d)|temporar|login required|not a bot|captcha',
+    re.IGNORECASE,
+)
+
+# Errors about the video itself: it stays out of reach for a while, but the
+# extractor works
+PERMANENT_ERRORS = re.compile(
+    r'private|been removed|deleted|video (?:is )?(?:no longer )?unavailable|does not exist|HTTP Error (?:404|410)|'
+    r'copyright|geo.?restrict|in your country|confirm your age|Unsupported URL',
+    re.IGNORECASE,
+)
+
+
+def is_permanent(error):
+    """True if error says the video is private, removed or blocked, not that the site is failing."""
+    message = str(error)
+    return not THROTTLED_ERRORS.search(message) and bool(PERMANENT_ERRORS.search(message))
+
+
+class CircuitOpen(Exception):
+    """The extractor kept failing, requests to it are refused for now."""
+
+    # Jobs refused this way are worth another attempt later
+    transient = True
+
+    def __init__(self, key, retry_after):
+        super().__init__(f"{key} is failing, not trying again for {retry_after:.0f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class KnownFailure(Exception):
+    """The URL failed for good a moment ago and is not tried again yet."""
+
+    # Whatever the earlier error said, retrying is what this saves
+    transient = False
+
+
+class _Circuit:
+    __slots__ = ('failures', 'until', 'cooldown', 'probing')
+
+    def __init__(self):
+        self.failures = 0
+        # While open: when the next probe may go
+        self.until = None
+        self.cooldown = 0
+        self.probing = False
+
+
+class CircuitBreaker:
+    """Per-key circuit breaker, keyed by extractor.
+
+    - Closed: calls go through; `threshold` failures in a row open it.
+    - Open: calls are refused with CircuitOpen for `cooldown` seconds.
+    - Half-open: then a single call goes through as a probe. Success
+      closes the circuit, failure opens it again for twice as long, up to
+      `max_cooldown`.
+
+    Call allow() before and success(), failure() or release() (neither,
+    e.g. cancelled) after each call. Used from the event loop only.
+    """
+
+    def __init__(self, threshold=5, cooldown=60, max_cooldown=900):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.opened = 0
+        self._circuits = {}
+
+    @property
+    def open(self):
+        """Keys whose circuit is open or half-open."""
+        return [key for key, circuit in self._circuits.items() if circuit.until is not None]
+
+    def allow(self, key):
+        """Let a call to key through, or raise CircuitOpen."""
+        circuit = self._circuits.get(key)
+        if circuit is None or circuit.until is None:
+            return
+        wait = circuit.until - time.monotonic()
+        if wait > 0 or circuit.probing:
+            raise CircuitOpen(key, max(wait, 0))
+        circuit.probing = True
+
+    def success(self, key):
+        circuit = self._circuits.pop(key, None)
+        if circuit is not None and circuit.until is not None:
+            logger.info(f"Circuit for {key} closed again")
+
+    def failure(self, key):
+        circuit = self._circuits.setdefault(key, _Circuit())
+        circuit.failures += 1
+        if circuit.probing:
+            circuit.probing = False
+            circuit.cooldown = min(circuit.cooldown * 2, self.max_cooldown)
+        elif circuit.until is None and circuit.failures >= self.threshold:
+            circuit.cooldown = self.cooldown
+            self.opened += 1
+            logger.warning(f"Circuit for {key} opened after {circuit.failures} failures in a row")
+        else:
+            return
+        circuit.until = time.monotonic() + circuit.cooldown
+
+    def release(self, key):
+        """The call neither proved nor disproved the key's health; let another probe."""
+        circuit = self._circuits.get(key)
+        if circuit is not None:
+            circuit.probing = False
+
+
+class FailureCache:
+    """Short-lived memory of URLs that failed for good (private, removed, geo-blocked).
+
+    Thread-safe, like MetadataCache.
+    """
+
+    def __init__(self, max_entries=4096, ttl=600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, url):
+        """Raise KnownFailure with the earlier error if url failed lately."""
+        key = canonical_url(url)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            if entry[1] < time.monotonic():
+                del self._entries[key]
+                return
+            self.hits += 1
+        raise KnownFailure(entry[0])
+
+    def add(self, url, error):
+        key = canonical_url(url)
+        with self._lock:
+            self._entries[key] = (str(error), time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
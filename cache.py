@@ -0,0 +1,203 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+logger = logging.getLogger(__name__)
+
+# Query parameters that only track where a link was shared from
+TRACKING_PARAMS = {
+    'fbclid', 'gclid', 'igshid', 'igsh', 'si', 'feature', 'ref_src',
+    'is_from_webapp', 'sender_device', 'share_id', 'mibextid', 'rdid',
+}
+
+# Info keys the bot never reads and that make up most of an info dict
+HEAVY_KEYS = {
+    'thumbnails', 'automatic_captions', 'subtitles', 'heatmap', 'chapters',
+    'description', 'tags', 'categories', 'comments',
+}
+
+# All the bot reads of a playlist entry
+ENTRY_KEYS = ('_type', 'id', 'title', 'url', 'webpage_url', 'ie_key')
+
+
+def canonical_url(url):
+    """Normalize a video URL so that equivalent links share a cache key."""
+    parts = urlsplit(url.strip())
+    host = (parts.hostname or '').lower()
+    for prefix in ('www.', 'm.', 'mobile.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    path = parts.path.rstrip('/') or '/'
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True)
+             if not k.startswith('utm_') and k not in TRACKING_PARAMS]
+
+    # A video in a playlist (list=...) is extracted as the playlist, so the
+    # list stays part of the key
+    if host == 'youtu.be':
+        playlist = [(k, v) for k, v in query if k == 'list']
+        host, query, path = 'youtube.com', [('v', path.lstrip('/'))] + playlist, '/watch'
+    elif host in ('youtube.com', 'music.youtube.com'):
+        host = 'youtube.com'
+        if path.startswith(('/shorts/', '/live/', '/embed/')):
+            query, path = [('v', path.split('/')[2])], '/watch'
+        elif path == '/watch':
+            query = [(k, v) for k, v in query if k in ('v', 'list')]
+    elif host == 'x.com':
+        host = 'twitter.com'
+
+    return urlunsplit(('https', host, path, urlencode(sorted(query)), ''))
+
+
+def slim_info(info):
+    """Return a JSON-safe copy of an info dict without the heavy, unused parts."""
+    # sanitize_info() counts entries as private, but batches need them
+    info = dict(info)
+    entries = info.pop('entries', None)
+    info = yt_dlp.YoutubeDL.sanitize_info(info, remove_private_keys=True)
+    if entries is not None:
+        info['entries'] = [
+            {key: entry[key] for key in ENTRY_KEYS if entry.get(key) is not None} if entry else None
+            for entry in entries
+        ]
+    for key in HEAVY_KEYS:
+        info.pop(key, None)
+    if 'formats' in info:
+        # Storyboards are image strips, they can never be sent
+        info['formats'] = [
+            {k: v for k, v in fmt.items() if k not in HEAVY_KEYS}
+            for fmt in info['formats']
+            if fmt.get('vcodec') != 'none' or fmt.get('acodec') != 'none'
+        ]
+    return info
+
+
+class MetadataCache:
+    """LRU + TTL cache of extract_info results, optionally backed by SQLite.
+
+    Thread-safe: it is used from the download pool's worker threads.
+    """
+
+    def __init__(self, max_entries=512, ttl=1800, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS metadata (key TEXT PRIMARY KEY, info TEXT, expires REAL)')
+            self._db.execute('DELETE FROM metadata WHERE expires < ?', (time.time(),))
+
+    def get(self, url):
+        """Return the cached info for url, or None if missing or expired."""
+        key = canonical_url(url)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self._db is not None:
+                row = self._db.execute(
+                    'SELECT info, expires FROM metadata WHERE key = ?', (key,)).fetchone()
+                if row:
+                    entry = (json.loads(row[0]), row[1])
+                    self._remember(key, entry)
+            if entry is None or entry[1] < now:
+                if entry is not None:
+                    self._forget(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, url, info):
+        """Store info under url and under the extractor's own webpage_url."""
+        entry = (info, time.time() + self.ttl)
+        keys = {canonical_url(url)}
+        if info.get('webpage_url'):
+            keys.add(canonical_url(info['webpage_url']))
+        with self._lock:
+            for key in keys:
+                self._remember(key, entry)
+            if self._db is not None:
+                data = json.dumps(info)
+                self._db.executemany(
+                    'INSERT OR REPLACE INTO metadata VALUES (?, ?, ?)',
+                    [(key, data, entry[1]) for key in keys])
+
+    def invalidate(self, url):
+        """Drop url from the cache, e.g. after its media URLs expired."""
+        with self._lock:
+            self._forget(canonical_url(url))
+
+    def _remember(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _forget(self, key):
+        self._entries.pop(key, None)
+        if self._db is not None:
+            self._db.execute('DELETE FROM metadata WHERE key = ?', (key,))
+
+
+class FileIdIndex:
+    """Persistent map of (extractor, video id, format choice) to Telegram file_ids.
+
+    Once Telegram has the file, resending it by file_id costs one API call
+    instead of a download, a transcode and an upload.
+    """
+
+    def __init__(self, path):
+        self.hits = 0
+        self.misses = 0
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute(
+            'CREATE TABLE IF NOT EXISTS file_ids ('
+            'extractor TEXT, video_id TEXT, format TEXT, kind TEXT, file_id TEXT, '
+            'hits INTEGER DEFAULT 0, created REAL, '
+            'PRIMARY KEY (extractor, video_id, format))')
+
+    def get(self, key):
+        """Return (kind, file_id) for key, or None."""
+        row = self._db.execute(
+            'SELECT kind, file_id FROM file_ids WHERE extractor = ? AND video_id = ? AND format = ?',
+            key).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._db.execute(
+            'UPDATE file_ids SET hits = hits + 1 WHERE extractor = ? AND video_id = ? AND format = ?',
+            key)
+        return row
+
+    def put(self, key, kind, file_id):
+        """Remember the file_id Telegram assigned to an upload."""
+        self._db.execute(
+            'INSERT OR REPLACE INTO file_ids (extractor, video_id, format, kind, file_id, created) '
+            'VALUES (?, ?, ?, ?, ?, ?)', (*key, kind, file_id, time.time()))
+
+    def forget(self, key):
+        """Drop a file_id Telegram no longer accepts."""
+        self._db.execute(
+            'DELETE FROM file_ids WHERE extractor = ? AND video_id = ? AND format = ?', key)
+
+
+def content_key(info, format_type):
+    """Index key for a download of info in the given format choice."""
+    extractor = info.get('extractor_key') or info.get('extractor') or 'generic'
+    return (extractor, str(info.get('id') or canonical_url(info.get('webpage_url', ''))), format_type)
@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import functools
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+logger = logging.getLogger(__name__)
+
+
+class Job:
+    """Handle for one piece of blocking work running in the download pool.
+
+    owner is the user it runs for; record, the id of the queued job it
+    works on, if any.
+    """
+
+    def __init__(self, name, owner=None, record=None):
+        self.name = name
+        self.owner = owner
+        self.record = record
+        self.cancelled = threading.Event()
+        self._callbacks = []
+
+    def cancel(self):
+        """Ask the worker to stop at the next yt-dlp progress callback."""
+        self.cancelled.set()
+        callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def on_cancel(self, callback):
+        """Call callback() when the job is cancelled, right away if it is already.
+
+        Only for jobs cancelled from the event loop.
+        """
+        if self.cancelled.is_set():
+            callback()
+        else:
+            self._callbacks.append(callback)
+
+    def check(self, d=None):
+        """yt-dlp progress hook that aborts the download once cancelled."""
+        if self.cancelled.is_set():
+            raise yt_dlp.utils.DownloadCancelled(f"Job {self.name} was cancelled")
+
+
+class DownloadExecutor:
+    """Bounded thread pool that runs yt-dlp work off the event loop."""
+
+    def __init__(self, max_workers=4, timeout=600):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="download")
+        self._jobs = {}
+
+    async def run(self, func, *args, job=None, timeout=None, **kwargs):
+        """Run func(*args, **kwargs) in the pool and wait for its result.
+
+        On timeout or cancellation of the awaiting task the job is flagged so
+        that the worker thread gives up at its next progress callback.
+        """
+        job = job or Job(func.__name__)
+        loop = asyncio.get_running_loop()
+        with self.track(job):
+            future = loop.run_in_executor(self._pool, functools.partial(func, *args, **kwargs))
+            try:
+                return await asyncio.wait_for(future, timeout or self.timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f"Job {job.name} timed out after {timeout or self.timeout}s")
+                job.cancel()
+                raise
+            except asyncio.CancelledError:
+                job.cancel()
+                raise
+
+    @contextlib.contextmanager
+    def track(self, job):
+        """Make job reachable by cancel() for the duration of the block.
+
+        For jobs that also do work outside the pool, such as ffmpeg or a
+        streamed upload. Nested blocks for the same job are fine.
+        """
+        jobs = self._jobs.setdefault(job.owner, set())
+        if job in jobs:
+            yield job
+            return
+        jobs.add(job)
+        try:
+            yield job
+        finally:
+            jobs.discard(job)
+            if not jobs and self._jobs.get(job.owner) is jobs:
+                del self._jobs[job.owner]
+
+    def cancel(self, owner):
+        """Cancel every running job of the given owner, returns how many."""
+        jobs = self._jobs.get(owner, ())
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def cancel_record(self, record):
+        """Cancel the running jobs working on the given queued job, returns how many."""
+        jobs = [job for owned in self._jobs.values() for job in owned if job.record == record]
+        for job in jobs:
+            job.cancel()
+        return len(jobs)
+
+    def shutdown(self):
+        """Cancel running jobs and stop the pool without waiting."""
+        for jobs in self._jobs.values():
+            for job in jobs:
+                job.cancel()
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class Flight:
+    """One in-progress run shared by every caller that asked for the same key."""
+
+    def __init__(self, key):
+        self.key = key
+        self.subscribers = []
+        self.callers = 0
+        self.task = None
+        # Cancelled because its leader left
+        self.abandoned = False
+
+
+class SingleFlight:
+    """Coalesces concurrent requests for the same key into a single run."""
+
+    def __init__(self):
+        self._flights = {}
+
+    async def run(self, key, func, subscriber=None, job=None):
+        """Run func(flight) for key, or join the run already in progress.
+
+        Returns (result, leader) where leader tells whether the result came
+        from this caller's own func. Cancelling `job` makes just this caller
+        leave, with DownloadCancelled; the run itself is cancelled once no
+        caller is left. If the leader leaves, the others start over, and
+        one of them runs its func instead.
+        """
+        while True:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = Flight(key)
+                self._flights[key] = flight
+                flight.task = asyncio.ensure_future(func(flight))
+                flight.task.add_done_callback(lambda _, flight=flight: self._land(flight))
+            flight.callers += 1
+            if subscriber is not None:
+                flight.subscribers.append(subscriber)
+            left = asyncio.get_running_loop().create_future()
+            if job is not None:
+                job.on_cancel(lambda: left.done() or left.set_result(None))
+            try:
+                await asyncio.wait((flight.task, left), return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                flight.callers -= 1
+                if subscriber in flight.subscribers:
+                    flight.subscribers.remove(subscriber)
+                # The leader's func delivers to the leader, the run is no use without it
+                if not flight.task.done() and (leader or not flight.callers):
+                    self._abandon(flight)
+            if left.done():
+                job.check()
+            if flight.abandoned:
+                continue
+            return flight.task.result(), leader
+
+    def _abandon(self, flight):
+        flight.abandoned = True
+        self._land(flight)
+        flight.task.cancel()
+
+    def _land(self, flight):
+        if self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
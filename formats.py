@@ -0,0 +1,115 @@
+import shutil
+
+# Container overhead on top of the raw stream bitrates
+OVERHEAD = 1.03
+
+# Audio streams that can be muxed into an mp4 without re-encoding
+MP4_AUDIO_EXTS = ('m4a', 'mp4')
+
+
+class FormatOption:
+    """One choice offered in the format keyboard."""
+
+    __slots__ = ('spec', 'height', 'size', 'merged')
+
+    def __init__(self, spec, height, size, merged=False):
+        self.spec = spec
+        self.height = height
+        self.size = size
+        self.merged = merged
+
+    @property
+    def label(self):
+        size = f"~{self.size / (1024 * 1024):.0f}MB" if self.size else "size unknown"
+        return f"📹 Video {self.height}p ({size})"
+
+
+def has_video(fmt):
+    return fmt.get('vcodec') != 'none'
+
+
+def has_audio(fmt):
+    return fmt.get('acodec') != 'none'
+
+
+def estimate_size(fmt, duration):
+    """Estimated bytes of a format: exact size, yt-dlp's estimate, or bitrate x duration."""
+    if fmt.get('filesize'):
+        return fmt['filesize']
+    if fmt.get('filesize_approx'):
+        return fmt['filesize_approx']
+    tbr = fmt.get('tbr') or ((fmt.get('vbr') or 0) + (fmt.get('abr') or 0))
+    if tbr and duration:
+        # tbr is in kbit/s
+        return int(tbr * 1000 / 8 * duration * OVERHEAD)
+    return None
+
+
+def audio_size(duration, kbps=192):
+    """Estimated size of the MP3 the audio button produces."""
+    return int(kbps * 1000 / 8 * duration) if duration else None
+
+
+def ffmpeg_available():
+    return shutil.which('ffmpeg') is not None
+
+
+def rank_formats(info, limit, max_options=5, allow_merge=None):
+    """Video options from info['formats'] that fit under limit bytes.
+
+    Candidates are progressive formats and, when ffmpeg is available, DASH
+    video-only formats merged with the smallest good audio stream. Options
+    whose estimated size exceeds the limit are dropped. For each height the
+    cheapest candidate wins (best quality per byte), preferring a
+    progressive file on ties since it needs no merge; options with unknown
+    size only fill heights nothing else covers. The result is sorted from
+    the highest resolution down.
+    """
+    if allow_merge is None:
+        allow_merge = ffmpeg_available()
+    duration = info.get('duration')
+    formats = info.get('formats') or []
+
+    candidates = []
+    for fmt in formats:
+        if has_video(fmt) and has_audio(fmt) and fmt.get('height'):
+            candidates.append(FormatOption(fmt['format_id'], fmt['height'], estimate_size(fmt, duration)))
+
+    if allow_merge:
+        audio = pick_audio(formats)
+        if audio is not None:
+            audio_bytes = estimate_size(audio, duration) or 0
+            for fmt in formats:
+                if has_video(fmt) and not has_audio(fmt) and fmt.get('height'):
+                    size = estimate_size(fmt, duration)
+                    candidates.append(FormatOption(
+                        f"{fmt['format_id']}+{audio['format_id']}", fmt['height'],
+                        size + audio_bytes if size else None, merged=True))
+
+    best = {}
+    for option in candidates:
+        if option.size is not None and option.size > limit:
+            continue
+        current = best.get(option.height)
+        if current is None or _better(option, current):
+            best[option.height] = option
+
+    return sorted(best.values(), key=lambda o: o.height, reverse=True)[:max_options]
+
+
+def pick_audio(formats):
+    """Audio-only stream to pair with DASH video: mp4-compatible, highest bitrate."""
+    audios = [f for f in formats if has_audio(f) and not has_video(f)]
+    if not audios:
+        return None
+    return max(audios, key=lambda f: (f.get('ext') in MP4_AUDIO_EXTS, f.get('abr') or f.get('tbr') or 0))
+
+
+def _better(option, current):
+    if option.size is None:
+        return False
+    if current.size is None:
+        return True
+    if option.size != current.size:
+        return option.size < current.size
+    return current.merged and not option.merged
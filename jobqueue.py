@@ -0,0 +1,207 @@
+import logging
+import re
+import sqlite3
+import time
+
+from telegram.error import BadRequest, NetworkError, RetryAfter
+
+logger = logging.getLogger(__name__)
+
+# yt-dlp errors worth another attempt later, as opposed to private/removed videos
+TRANSIENT_ERRORS = re.compile(
+    r'timed? ?out|HTTP Error (?:429|5\d\d)|connection|temporar|reset by peer|unable to download',
+    re.IGNORECASE,
+)
+
+
+def is_transient(error):
+    """True if a failed job may succeed when retried later.
+
+    An error's own `transient` attribute, when it has one, decides.
+    """
+    transient = getattr(error, 'transient', None)
+    if transient is not None:
+        return bool(transient)
+    if isinstance(error, (ConnectionError, RetryAfter)):
+        return True
+    if isinstance(error, NetworkError):
+        return not isinstance(error, BadRequest)
+    return bool(TRANSIENT_ERRORS.search(str(error)))
+
+
+class JobRecord:
+    """A download a user asked for, as stored in the job database."""
+
+    __slots__ = ('id', 'user_id', 'chat_id', 'url', 'format_type', 'attempts')
+
+    def __init__(self, id, user_id, chat_id, url, format_type, attempts):
+        self.id = id
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.url = url
+        self.format_type = format_type
+        self.attempts = attempts
+
+
+class JobQueue:
+    """Durable log of incoming updates and accepted download jobs (SQLite, WAL).
+
+    Updates are written before Telegram is told they arrived and deleted
+    once handled, so a crash replays them instead of losing them. Jobs stay
+    in the database until they finish or run out of attempts. Any number of
+    processes on one host can share the file as their broker: a worker
+    claims jobs under a lease it keeps renewing, and jobs whose lease runs
+    out (the worker died) go back to the queue.
+    """
+
+    def __init__(self, path, max_attempts=4, backoff=30):
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS updates (
+                update_id INTEGER PRIMARY KEY, payload TEXT, received REAL);
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, user_id INTEGER, chat_id INTEGER,
+                url TEXT, format_type TEXT, status TEXT, attempts INTEGER DEFAULT 0,
+                next_attempt REAL, error TEXT, created REAL,
+                owner TEXT, lease_until REAL, cancelled INTEGER DEFAULT 0);
+            CREATE INDEX IF NOT EXISTS jobs_due ON jobs (status, next_attempt);
+            CREATE TABLE IF NOT EXISTS state (key TEXT PRIMARY KEY, value);
+        ''')
+        # Databases from before workers had leases
+        columns = {row[1] for row in self._db.execute('PRAGMA table_info(jobs)')}
+        for column in ('owner TEXT', 'lease_until REAL', 'cancelled INTEGER DEFAULT 0'):
+            if column.split()[0] not in columns:
+                self._db.execute(f'ALTER TABLE jobs ADD COLUMN {column}')
+
+    # Updates
+
+    def record_update(self, update_id, payload, in_order=True):
+        """Persist an incoming update, returns False if it was seen before.
+
+        Polled updates come in order, so anything up to the last id is a
+        repeat. Webhook deliveries overlap (in_order=False); there only an
+        update still in the inbox counts as seen.
+        """
+        row = self._db.execute("SELECT value FROM state WHERE key = 'last_update_id'").fetchone()
+        if in_order and row is not None and update_id <= row[0]:
+            return False
+        with self._db:
+            self._db.execute('BEGIN')
+            cursor = self._db.execute('INSERT OR IGNORE INTO updates VALUES (?, ?, ?)',
+                                      (update_id, payload, time.time()))
+            if row is None or update_id > row[0]:
+                self._db.execute("INSERT OR REPLACE INTO state VALUES ('last_update_id', ?)", (update_id,))
+        return cursor.rowcount > 0
+
+    def ack_update(self, update_id):
+        """Forget an update once its handler has finished with it."""
+        self._db.execute('DELETE FROM updates WHERE update_id = ?', (update_id,))
+
+    def pending_updates(self, window):
+        """Payloads of updates received in the last `window` seconds but never handled."""
+        self._db.execute('DELETE FROM updates WHERE received < ?', (time.time() - window,))
+        return [row[0] for row in self._db.execute('SELECT payload FROM updates ORDER BY update_id')]
+
+    # Jobs
+
+    def submit(self, user_id, chat_id, url, format_type):
+        """Queue a new job, returns its JobRecord."""
+        now = time.time()
+        cursor = self._db.execute(
+            "INSERT INTO jobs (user_id, chat_id, url, format_type, status, next_attempt, created) "
+            "VALUES (?, ?, ?, ?, 'queued', ?, ?)", (user_id, chat_id, url, format_type, now, now))
+        return JobRecord(cursor.lastrowid, user_id, chat_id, url, format_type, 0)
+
+    def claim(self, worker, limit, lease, per_user=None):
+        """Take up to `limit` due jobs for `worker` for `lease` seconds.
+
+        Users take turns, and none gets more than `per_user` jobs running
+        across all workers.
+        """
+        if limit <= 0:
+            return []
+        now = time.time()
+        with self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            # Each user's first due job comes before anyone's second
+            rows = self._db.execute(
+                "SELECT id, user_id, chat_id, url, format_type, attempts + 1 FROM ("
+                "  SELECT *, ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY next_attempt, id) AS turn"
+                "  FROM jobs WHERE status = 'queued' AND next_attempt <= ?) AS due "
+                "WHERE ? IS NULL OR turn + (SELECT COUNT(*) FROM jobs "
+                "  WHERE status = 'running' AND user_id = due.user_id) <= ? "
+                "ORDER BY turn, next_attempt LIMIT ?",
+                (now, per_user, per_user, limit)).fetchall()
+            self._db.executemany(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, owner = ?, lease_until = ? "
+                "WHERE id = ?", [(worker, now + lease, row[0]) for row in rows])
+        return [JobRecord(*row) for row in rows]
+
+    def renew(self, worker, lease, job_ids):
+        """Extend the lease on the worker's jobs still running in job_ids.
+
+        Returns [(job_id, user_id)] of those cancelled. Jobs left out (their
+        task crashed) keep their old lease and are requeued once it runs out.
+        """
+        job_ids = list(job_ids)
+        if not job_ids:
+            return []
+        marks = ', '.join('?' * len(job_ids))
+        self._db.execute(
+            f"UPDATE jobs SET lease_until = ? WHERE status = 'running' AND owner = ? AND id IN ({marks})",
+            (time.time() + lease, worker, *job_ids))
+        return self._db.execute(
+            f"SELECT id, user_id FROM jobs WHERE status = 'running' AND owner = ? AND cancelled AND id IN ({marks})",
+            (worker, *job_ids)).fetchall()
+
+    def requeue_expired(self):
+        """Put jobs whose lease ran out back in the queue, returns how many."""
+        now = time.time()
+        with self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            # A job that keeps killing its worker must not come back forever
+            self._db.execute(
+                "DELETE FROM jobs WHERE status = 'running' AND lease_until < ? AND (cancelled OR attempts >= ?)",
+                (now, self.max_attempts))
+            cursor = self._db.execute(
+                "UPDATE jobs SET status = 'queued', next_attempt = ?, owner = NULL "
+                "WHERE status = 'running' AND lease_until < ?", (now, now))
+        return cursor.rowcount
+
+    def cancel(self, user_id):
+        """Drop the user's queued jobs and flag the running ones, returns how many."""
+        with self._db:
+            self._db.execute('BEGIN IMMEDIATE')
+            dropped = self._db.execute(
+                "DELETE FROM jobs WHERE user_id = ? AND status = 'queued'", (user_id,)).rowcount
+            flagged = self._db.execute(
+                "UPDATE jobs SET cancelled = 1 WHERE user_id = ? AND status = 'running'", (user_id,)).rowcount
+        return dropped + flagged
+
+    def finish(self, job_id):
+        self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def fail(self, job_id, error):
+        logger.info(f"Job {job_id} failed for good: {error}")
+        self._db.execute('DELETE FROM jobs WHERE id = ?', (job_id,))
+
+    def retry(self, job, error):
+        """Schedule another attempt with exponential backoff.
+
+        Returns the delay in seconds, or None if the job is out of attempts.
+        """
+        if job.attempts >= self.max_attempts:
+            self.fail(job.id, error)
+            return None
+        delay = self.backoff * 2 ** (job.attempts - 1)
+        self._db.execute(
+            "UPDATE jobs SET status = 'queued', next_attempt = ?, error = ?, owner = NULL WHERE id = ?",
+            (time.time() + delay, str(error), job.id))
+        return delay
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM jobs').fetchone()[0]
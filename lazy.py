@@ -0,0 +1,19 @@
+import importlib
+
+
+class LazyModule:
+    """Stands in for a module that is only imported on first attribute access.
+
+    For heavy imports (yt-dlp loads hundreds of modules) that should not
+    delay startup. Safe to touch from several threads at once: the import
+    itself goes through importlib's per-module locks.
+    """
+
+    def __init__(self, name):
+        self.__name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self.__name), attr)
+
+    def __repr__(self):
+        return f"<lazy module {self.__name!r}>"
@@ -0,0 +1,247 @@
+import asyncio
+import bisect
+import contextlib
+import itertools
+import logging
+import time
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+from scheduler import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+# Call priorities, lowest first
+DELIVERY, REPLY, EDIT = 0, 1, 2
+
+PRIORITIES = {
+    'sendVideo': DELIVERY, 'sendAudio': DELIVERY, 'sendDocument': DELIVERY,
+    'sendAnimation': DELIVERY, 'sendMediaGroup': DELIVERY,
+    'editMessageText': EDIT, 'editMessageCaption': EDIT, 'editMessageReplyMarkup': EDIT,
+}
+
+# Edits that a later edit of the same message makes pointless
+EDIT_METHODS = {'editMessageText', 'editMessageCaption', 'editMessageReplyMarkup'}
+
+# Calls that post a message count against their chat's limit; edits and
+# deletions only against the global one
+POSTING_PREFIXES = ('send', 'copyMessage', 'forwardMessage')
+
+# Not subject to the message limits; callback answers must also be quick
+EXEMPT = {'getMe', 'getFile', 'getWebhookInfo', 'setWebhook', 'deleteWebhook', 'logOut', 'close',
+          'answerCallbackQuery'}
+
+
+class Superseded(Exception):
+    """A newer edit of the same message took this call's place in the queue."""
+
+
+class _Call:
+    __slots__ = ('priority', 'seq', 'chat_id', 'posting', 'key', 'admitted', 'outcome')
+
+    def __init__(self, priority, seq, chat_id, posting, key, admitted, outcome=None):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.posting = posting
+        self.key = key
+        self.admitted = admitted
+        # Shared with the callers of the edits this call superseded
+        self.outcome = outcome
+
+
+class OutboundScheduler(BaseRateLimiter):
+    """Rate limiter for every Bot API call the bot makes (ExtBot.rate_limiter).
+
+    - Calls take a token from a global bucket (`global_rate` calls/s), and
+      those posting a message also from their chat's bucket (`chat_rate`
+      for private chats, `group_rate` for groups and channels), after
+      Telegram's documented flood limits.
+    - Waiting calls go out by priority (DELIVERY, REPLY, EDIT by method, or
+      rate_limit_args={'priority': ...}), first come first served within
+      one. A call whose chat is out of tokens does not hold up other chats.
+    - A queued edit is dropped when a newer edit of the same message comes
+      in; its caller gets the newer edit's result.
+    - RetryAfter pauses the chat (everything, for calls without a chat) and
+      the call is queued again, unless the wait exceeds `max_retry_after`.
+    """
+
+    def __init__(self, global_rate=30, chat_rate=1, chat_burst=3, group_rate=20 / 60, group_burst=5,
+                 max_retry_after=60):
+        self.global_rate = global_rate
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_retry_after = max_retry_after
+        self.superseded = 0
+        self.retried = 0
+        self._global = TokenBucket(global_rate)
+        self._chats = {}
+        self._paused = {}
+        self._queue = []
+        self._edits = {}
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._dispatcher = None
+
+    @property
+    def queued(self):
+        return len(self._queue)
+
+    async def initialize(self):
+        if self._dispatcher is None:
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._dispatcher
+            self._dispatcher = None
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        if endpoint in EXEMPT:
+            return await callback(*args, **kwargs)
+        chat_id = data.get('chat_id')
+        priority = (rate_limit_args or {}).get('priority', PRIORITIES.get(endpoint, REPLY))
+        posting = endpoint.startswith(POSTING_PREFIXES)
+        key = (chat_id, data['message_id']) if endpoint in EDIT_METHODS and data.get('message_id') else None
+        outcome = None
+        while True:
+            call = self._enqueue(chat_id, priority, posting, key, outcome)
+            try:
+                await call.admitted
+            except Superseded:
+                return await asyncio.shield(call.outcome)
+            except asyncio.CancelledError:
+                self._drop(call)
+                if call.outcome is not None:
+                    call.outcome.cancel()
+                raise
+            outcome = call.outcome
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as e:
+                self._pause(chat_id, e.retry_after)
+                if e.retry_after > self.max_retry_after:
+                    self._resolve(outcome, error=e)
+                    raise
+                self.retried += 1
+                logger.info(f"{endpoint} to {chat_id} hit the flood limit, retrying in {e.retry_after}s")
+                newer = self._edits.get(key) if key is not None else None
+                if newer is not None:
+                    # A newer edit of the message is already queued, it answers for this one
+                    if newer.outcome is None:
+                        newer.outcome = asyncio.get_running_loop().create_future()
+                    if outcome is not None:
+                        newer.outcome.add_done_callback(lambda done, shared=outcome: self._chain(done, shared))
+                    self.superseded += 1
+                    return await asyncio.shield(newer.outcome)
+                continue
+            except BaseException as e:
+                self._resolve(outcome, error=e)
+                raise
+            self._resolve(outcome, result=result)
+            return result
+
+    def _enqueue(self, chat_id, priority, posting, key, outcome):
+        loop = asyncio.get_running_loop()
+        older = self._edits.get(key) if key is not None else None
+        if older is None:
+            call = _Call(priority, next(self._seq), chat_id, posting, key, loop.create_future(), outcome)
+        else:
+            # Take the older edit's place in the queue and answer its caller too
+            self._drop(older)
+            if older.outcome is None:
+                older.outcome = loop.create_future()
+            call = _Call(priority, older.seq, chat_id, posting, key, loop.create_future(), older.outcome)
+            older.admitted.set_exception(Superseded())
+            self.superseded += 1
+        if key is not None:
+            self._edits[key] = call
+        bisect.insort(self._queue, call, key=lambda c: (c.priority, c.seq))
+        self._wakeup.set()
+        return call
+
+    def _drop(self, call):
+        with contextlib.suppress(ValueError):
+            self._queue.remove(call)
+        if call.key is not None and self._edits.get(call.key) is call:
+            del self._edits[call.key]
+
+    @staticmethod
+    def _chain(done, shared):
+        if shared.done():
+            return
+        if done.cancelled():
+            shared.cancel()
+        elif done.exception() is not None:
+            shared.set_exception(done.exception())
+        else:
+            shared.set_result(done.result())
+
+    @staticmethod
+    def _resolve(outcome, result=None, error=None):
+        if outcome is None or outcome.done():
+            return
+        if isinstance(error, asyncio.CancelledError):
+            outcome.cancel()
+        elif error is not None:
+            outcome.set_exception(error)
+        else:
+            outcome.set_result(result)
+
+    def _pause(self, chat_id, seconds):
+        until = time.monotonic() + seconds
+        self._paused[chat_id] = max(self._paused.get(chat_id, 0), until)
+        self._wakeup.set()
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) > 10000:
+                # Chats with a full bucket are idle, nothing to remember
+                self._chats = {c: b for c, b in self._chats.items() if not b.full}
+            group = isinstance(chat_id, str) or chat_id < 0
+            bucket = self._chats[chat_id] = (TokenBucket(self.group_rate, self.group_burst) if group
+                                             else TokenBucket(self.chat_rate, self.chat_burst))
+        return bucket
+
+    def _chat_wait(self, chat_id, now, posting=False):
+        paused = self._paused.get(chat_id, 0) - now
+        if paused > 0:
+            return paused
+        self._paused.pop(chat_id, None)
+        return self._bucket(chat_id).wait_time() if posting and chat_id is not None else 0
+
+    def _grant(self):
+        """Admit every call that may go now; returns seconds until the next could, or None."""
+        now = time.monotonic()
+        soonest = None
+        for call in list(self._queue):
+            wait = max(self._chat_wait(None, now), self._global.wait_time())
+            if wait > 0:
+                return wait
+            if call.chat_id is not None:
+                wait = self._chat_wait(call.chat_id, now, call.posting)
+                if wait > 0:
+                    soonest = wait if soonest is None else min(soonest, wait)
+                    continue
+                if call.posting:
+                    self._bucket(call.chat_id).take()
+            self._global.take()
+            self._drop(call)
+            call.admitted.set_result(None)
+        return soonest
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            delay = self._grant()
+            if delay is None:
+                await self._wakeup.wait()
+            else:
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), max(delay, 0.001))
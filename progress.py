@@ -0,0 +1,94 @@
+import asyncio
+import logging
+import threading
+import time
+
+from telegram.error import TelegramError
+
+logger = logging.getLogger(__name__)
+
+
+def render(d):
+    """Progress message text for a yt-dlp progress dict, or None to skip it."""
+    if d['status'] == 'downloading':
+        percent = d.get('_percent_str', '0%').strip()
+        speed = d.get('_speed_str', 'N/A').strip()
+        eta = d.get('_eta_str', 'N/A').strip()
+        return f"⬇️ Downloading...\nProgress: {percent}\nSpeed: {speed}\nETA: {eta}"
+    if d['status'] == 'finished':
+        return "✅ Download complete!\n⏫ Uploading to Telegram..."
+    return None
+
+
+class ProgressReporter:
+    """Throttled progress display for one job.
+
+    hook() may be called from any thread as often as yt-dlp likes; only the
+    latest state is kept. A task on the event loop flushes it to each message
+    at most once every `interval` seconds, and only while the shared budget
+    has edits to spare.
+    """
+
+    def __init__(self, messages, budget, interval=3.0):
+        self.messages = messages
+        self.budget = budget
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._latest = None
+        self._shown = {}
+        self._last_edit = {}
+        self._task = None
+
+    def hook(self, d):
+        """yt-dlp progress hook, safe to call from worker threads."""
+        text = render(d)
+        if text is not None:
+            with self._lock:
+                self._latest = text
+
+    async def show(self, text):
+        """Replace the status on every message right away (phase changes)."""
+        with self._lock:
+            self._latest = None
+        for msg in list(self.messages):
+            await self._edit(msg, text)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(min(1.0, self.interval))
+            with self._lock:
+                text = self._latest
+            if text is None:
+                continue
+            now = time.monotonic()
+            for msg in list(self.messages):
+                key = (msg.chat_id, msg.message_id)
+                if now - self._last_edit.get(key, 0) < self.interval:
+                    continue
+                if self._shown.get(key) == text or not self.budget.take():
+                    continue
+                await self._edit(msg, text)
+
+    async def _edit(self, msg, text):
+        key = (msg.chat_id, msg.message_id)
+        self._last_edit[key] = time.monotonic()
+        if self._shown.get(key) == text:
+            return
+        self._shown[key] = text
+        try:
+            await msg.edit_text(text)
+        except TelegramError as e:
+            logger.debug(f"Progress edit failed: {e}")
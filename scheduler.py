@@ -0,0 +1,185 @@
+import asyncio
+import contextlib
+import time
+from collections import Counter, OrderedDict, deque
+
+# How often queued jobs re-check their position in the queue
+POSITION_POLL = 2.0
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens per second, at most `capacity` saved up."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._stamp = time.monotonic()
+
+    def take(self):
+        """Spend one token if available, returns False otherwise."""
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def wait_time(self):
+        """Seconds until take() can succeed, 0 if it can now."""
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    @property
+    def full(self):
+        self._refill()
+        return self._tokens >= self.capacity
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._stamp) * self.rate)
+        self._stamp = now
+
+
+class Busy(Exception):
+    """The user already has too many jobs waiting."""
+
+
+class _Waiter:
+    __slots__ = ('user_id', 'resource', 'future')
+
+    def __init__(self, user_id, resource, future):
+        self.user_id = user_id
+        self.resource = resource
+        self.future = future
+
+
+class FairScheduler:
+    """Admission control and round-robin ordering in front of the download path.
+
+    - admit() applies a per-user token bucket to new requests.
+    - slot() waits for a free slot of a resource class (e.g. 'network' for
+      plain downloads, 'cpu' for ffmpeg work), at most `per_user` at a time
+      per user. Free slots go to the user with the fewest running jobs, in
+      round-robin order, so one user with a long queue cannot starve
+      everyone else.
+    """
+
+    def __init__(self, slots, per_user=2, max_queued=5, rate=10 / 60, burst=5):
+        self.slots = dict(slots)
+        self.per_user = per_user
+        self.max_queued = max_queued
+        self.rate = rate
+        self.burst = burst
+        self._free = dict(slots)
+        self._active = Counter()
+        self._buckets = {}
+        # user_id -> deque of waiters; dict order is the round-robin ring
+        self._queues = OrderedDict()
+
+    def admit(self, user_id):
+        """Charge one request to the user's rate limit, False if over it."""
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                # Users with a full bucket are idle, nothing to remember
+                self._buckets = {u: b for u, b in self._buckets.items() if not b.full}
+            bucket = self._buckets[user_id] = TokenBucket(self.rate, self.burst)
+        return bucket.take()
+
+    @contextlib.asynccontextmanager
+    async def slot(self, user_id, resource, on_position=None):
+        """Hold one `resource` slot for the body of the with-block.
+
+        on_position(n) is awaited whenever the job's place in the queue changes.
+        """
+        await self._acquire(user_id, resource, on_position)
+        try:
+            yield
+        finally:
+            self._release(user_id, resource)
+
+    @property
+    def queued(self):
+        return sum(len(q) for q in self._queues.values())
+
+    @property
+    def active(self):
+        return sum(self._active.values())
+
+    def position(self, waiter):
+        """1-based place of waiter in the round-robin order, 0 once running."""
+        queue = self._queues.get(waiter.user_id)
+        if not queue or waiter not in queue:
+            return 0
+        index = queue.index(waiter)
+        position = 0
+        ahead = True
+        for user_id, other in self._queues.items():
+            if user_id == waiter.user_id:
+                position += index + 1
+                ahead = False
+            else:
+                position += min(len(other), index + 1 if ahead else index)
+        return position
+
+    async def _acquire(self, user_id, resource, on_position):
+        queue = self._queues.get(user_id)
+        if queue and len(queue) >= self.max_queued:
+            raise Busy(f"{len(queue)} jobs already queued")
+        waiter = _Waiter(user_id, resource, asyncio.get_running_loop().create_future())
+        self._queues.setdefault(user_id, deque()).append(waiter)
+        self._dispatch()
+
+        shown = None
+        try:
+            while not waiter.future.done():
+                position = self.position(waiter)
+                if on_position is not None and position != shown:
+                    shown = position
+                    await on_position(position)
+                try:
+                    await asyncio.wait_for(asyncio.shield(waiter.future), POSITION_POLL)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            if waiter.future.done():
+                # Got the slot just as we were cancelled, give it back
+                self._release(user_id, resource)
+            else:
+                waiter.future.cancel()
+                self._remove(waiter)
+            raise
+
+    def _release(self, user_id, resource):
+        self._active[user_id] -= 1
+        if self._active[user_id] <= 0:
+            del self._active[user_id]
+        self._free[resource] += 1
+        self._dispatch()
+
+    def _remove(self, waiter):
+        queue = self._queues.get(waiter.user_id)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.user_id]
+
+    def _dispatch(self):
+        while True:
+            # Among users whose next job can start, serve the one with the
+            # fewest running jobs; ties go to whoever is first in the ring
+            eligible = [
+                (self._active[user_id], user_id) for user_id, queue in self._queues.items()
+                if self._active[user_id] < self.per_user and self._free[queue[0].resource] > 0
+            ]
+            if not eligible:
+                return
+            _, user_id = min(eligible, key=lambda item: item[0])
+            queue = self._queues.pop(user_id)
+            waiter = queue.popleft()
+            self._active[user_id] += 1
+            self._free[waiter.resource] -= 1
+            waiter.future.set_result(None)
+            # Served users go to the back of the ring
+            if queue:
+                self._queues[user_id] = queue
@@ -0,0 +1,128 @@
+import asyncio
+import contextlib
+import logging
+import os
+import secrets
+import shutil
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class NoSpace(Exception):
+    """Not enough scratch space for the job, even after waiting."""
+
+    # Worth retrying later, once other jobs have freed their space
+    transient = True
+
+
+class Scratch:
+    """Disk budget for job directories under one root.
+
+    Each job gets its own directory, created by acquire() after reserving
+    the job's estimated size. When the reservation would take the total
+    over `budget` bytes, or leave less than `min_free` bytes free on the
+    disk, acquire() waits up to `max_wait` seconds for other jobs to
+    release theirs, then raises NoSpace.
+
+    Directories are named after the owning process, so sweep() can delete
+    those left behind by a crash or a leak without touching live jobs of
+    other processes sharing the root.
+    """
+
+    def __init__(self, root, budget, min_free=0, max_wait=300, sweep_interval=300):
+        self.root = root
+        self.budget = budget
+        self.min_free = min_free
+        self.max_wait = max_wait
+        self.sweep_interval = sweep_interval
+        self._reserved = {}
+        self._changed = asyncio.Condition()
+        self._swept = 0.0
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def reserved(self):
+        return sum(self._reserved.values())
+
+    async def acquire(self, nbytes, on_wait=None):
+        """Reserve nbytes and return a fresh job directory.
+
+        on_wait() is awaited once if the job has to wait for space.
+        """
+        if nbytes > self.budget:
+            raise NoSpace(f"job needs {nbytes} bytes, scratch budget is {self.budget}")
+        async with self._changed:
+            if not self._fits(nbytes):
+                if on_wait is not None:
+                    await on_wait()
+                try:
+                    await asyncio.wait_for(self._changed.wait_for(lambda: self._fits(nbytes)), self.max_wait)
+                except asyncio.TimeoutError:
+                    raise NoSpace(f"no room for {nbytes} bytes after {self.max_wait}s") from None
+            path = os.path.join(self.root, f"job-{os.getpid()}-{secrets.token_hex(6)}")
+            os.makedirs(path)
+            self._reserved[path] = nbytes
+            return path
+
+    async def release(self, path):
+        """Delete a job directory and give its reservation back."""
+        shutil.rmtree(path, ignore_errors=True)
+        async with self._changed:
+            if self._reserved.pop(path, None) is not None:
+                self._changed.notify_all()
+
+    async def shrink(self, path, nbytes):
+        """Lower a job's reservation to nbytes, once it knows what it really needs."""
+        async with self._changed:
+            if self._reserved.get(path, 0) > nbytes:
+                self._reserved[path] = nbytes
+                self._changed.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def reserve(self, nbytes, on_wait=None):
+        """acquire() for the body of the with-block, released afterwards."""
+        path = await self.acquire(nbytes, on_wait)
+        try:
+            yield path
+        finally:
+            await self.release(path)
+
+    def sweep(self, force=False):
+        """Delete job directories no live job owns; runs at most every sweep_interval."""
+        now = time.monotonic()
+        if not force and now - self._swept < self.sweep_interval:
+            return 0
+        self._swept = now
+        removed = 0
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if path in self._reserved or not name.startswith('job-'):
+                continue
+            try:
+                pid = int(name.split('-')[1])
+            except (IndexError, ValueError):
+                continue
+            # Same pid but not reserved: ours from an earlier run (containers reuse pids) or leaked
+            if pid != os.getpid() and _alive(pid):
+                continue
+            shutil.rmtree(path, ignore_errors=True)
+            removed += 1
+        if removed:
+            logger.info(f"Removed {removed} orphaned scratch directories")
+        return removed
+
+    def _fits(self, nbytes):
+        if self.reserved + nbytes > self.budget:
+            return False
+        return shutil.disk_usage(self.root).free - nbytes >= self.min_free
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,73 @@
+import secrets
+import sqlite3
+import time
+
+
+class Choice:
+    """A format button waiting to be pressed."""
+
+    __slots__ = ('user_id', 'chat_id', 'url', 'format_type', 'expires')
+
+    def __init__(self, user_id, chat_id, url, format_type, expires):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.url = url
+        self.format_type = format_type
+        self.expires = expires
+
+
+class ChoiceStore:
+    """Server-side state behind inline buttons, kept on disk (SQLite).
+
+    Each button carries only a short opaque token in its callback_data, well
+    inside Telegram's 64-byte limit. Entries survive restarts, expire after
+    `ttl` seconds and the oldest are evicted once `max_entries` is reached.
+    """
+
+    def __init__(self, path, ttl=3600, max_entries=20000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS choices (
+                token TEXT PRIMARY KEY, user_id INTEGER, chat_id INTEGER,
+                url TEXT, format_type TEXT, expires REAL);
+            CREATE INDEX IF NOT EXISTS choices_expires ON choices (expires);
+        ''')
+
+    def add(self, user_id, chat_id, url, format_type):
+        """Store a choice and return its token."""
+        now = time.time()
+        self._db.execute('DELETE FROM choices WHERE expires < ?', (now,))
+        while True:
+            token = secrets.token_urlsafe(6)
+            cursor = self._db.execute(
+                'INSERT OR IGNORE INTO choices VALUES (?, ?, ?, ?, ?, ?)',
+                (token, user_id, chat_id, url, format_type, now + self.ttl))
+            if cursor.rowcount:
+                break
+        # Entries share one TTL, so the oldest expire first
+        self._db.execute(
+            'DELETE FROM choices WHERE rowid IN (SELECT rowid FROM choices ORDER BY expires DESC LIMIT -1 OFFSET ?)',
+            (self.max_entries,))
+        return token
+
+    def get(self, token):
+        """The choice for token, left in place, or None if unknown or expired."""
+        row = self._db.execute(
+            'SELECT user_id, chat_id, url, format_type, expires FROM choices WHERE token = ?', (token,)).fetchone()
+        if row is None or row[4] < time.time():
+            return None
+        return Choice(*row)
+
+    def pop(self, token):
+        """Remove and return the choice for token, or None if unknown or expired."""
+        choice = self.get(token)
+        # Another process sharing the file may have taken it meanwhile
+        if not self._db.execute('DELETE FROM choices WHERE token = ?', (token,)).rowcount:
+            return None
+        return choice
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM choices').fetchone()[0]
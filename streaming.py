@@ -0,0 +1,182 @@
+import asyncio
+import contextlib
+import json
+import logging
+import sys
+import time
+import uuid
+
+import httpx
+from telegram import Message
+from telegram.error import BadRequest, NetworkError, RetryAfter
+from telegram.request import BaseRequest
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+logger = logging.getLogger(__name__)
+
+# Only plain progressive files can go straight from yt-dlp's stdout to Telegram
+STREAMABLE_PROTOCOLS = {'http', 'https'}
+
+CHUNK_SIZE = 256 * 1024
+
+
+class StreamFailed(Exception):
+    """The streaming path could not deliver the file; use the temp-file path."""
+
+
+class FileTooLarge(Exception):
+    """The file is bigger than the Bot API server accepts."""
+
+
+def pick_stream_format(info, format_spec, ydl=None):
+    """Return the format format_spec selects if it can be piped, else None.
+
+    A format can be piped when it is a single file served over plain HTTP,
+    i.e. yt-dlp neither merges streams nor post-processes it. ydl, if given,
+    is a YoutubeDL to build the selector with instead of a new one.
+    """
+    formats = info.get('formats') or [info]
+    with contextlib.nullcontext(ydl) if ydl is not None else yt_dlp.YoutubeDL({'quiet': True}) as ydl:
+        selector = ydl.build_format_selector(format_spec)
+        chosen = list(selector({
+            'formats': formats,
+            'has_merged_format': any('none' not in (f.get('acodec'), f.get('vcodec')) for f in formats),
+            'incomplete_formats': (all(f.get('vcodec') == 'none' for f in formats)
+                                   or all(f.get('acodec') == 'none' for f in formats)),
+        }))
+    if len(chosen) != 1 or chosen[0].get('requested_formats'):
+        return None
+    fmt = chosen[0]
+    if fmt.get('protocol') not in STREAMABLE_PROTOCOLS or not fmt.get('url'):
+        return None
+    return fmt
+
+
+class MediaPipe:
+    """yt-dlp subprocess writing one format to stdout, read through a bounded buffer.
+
+    The cached info dict is fed on stdin (--load-info-json -), so the site
+    is not extracted again and nothing touches the disk.
+    """
+
+    def __init__(self, info, fmt, buffer_chunks=16, job=None, progress_hook=None, limit=None):
+        self.info = info
+        self.format_id = fmt['format_id']
+        self.job = job
+        self.limit = limit
+        self.progress_hook = progress_hook
+        self.total = fmt.get('filesize') or fmt.get('filesize_approx')
+        self.received = 0
+        self.started = time.monotonic()
+        self._queue = asyncio.Queue(maxsize=buffer_chunks)
+        self._proc = None
+        self._reader = None
+
+    async def start(self):
+        self._proc = await asyncio.create_subprocess_exec(
+            sys.executable, '-m', 'yt_dlp', '--load-info-json', '-',
+            '-f', self.format_id, '-o', '-', '--quiet', '--no-progress', '--no-part',
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._proc.stdin.write(json.dumps(self.info).encode())
+        await self._proc.stdin.drain()
+        self._proc.stdin.close()
+        self._reader = asyncio.create_task(self._read())
+        return self
+
+    async def _read(self):
+        while True:
+            chunk = await self._proc.stdout.read(CHUNK_SIZE)
+            await self._queue.put(chunk)
+            if not chunk:
+                return
+
+    async def chunks(self):
+        """Async iterator over the media bytes; raises StreamFailed on errors."""
+        while True:
+            if self.job is not None and self.job.cancelled.is_set():
+                self.kill()
+                raise yt_dlp.utils.DownloadCancelled("Stream cancelled")
+            chunk = await self._queue.get()
+            if not chunk:
+                break
+            self.received += len(chunk)
+            if self.limit and self.received > self.limit:
+                self.kill()
+                raise FileTooLarge(f"Stream exceeded {self.limit} bytes")
+            if self.progress_hook is not None:
+                self.progress_hook(self.progress())
+            yield chunk
+        stderr = await self._proc.stderr.read()
+        if await self._proc.wait() != 0 or not self.received:
+            raise StreamFailed(stderr.decode(errors='replace').strip() or "yt-dlp produced no data")
+
+    def progress(self):
+        """Current state as a yt-dlp style progress dict."""
+        speed = self.received / max(time.monotonic() - self.started, 1e-3)
+        d = {
+            'status': 'downloading',
+            '_percent_str': 'N/A',
+            '_speed_str': f"{yt_dlp.utils.format_bytes(speed)}/s",
+            '_eta_str': 'N/A',
+        }
+        if self.total:
+            d['_percent_str'] = f"{min(100.0, 100 * self.received / self.total):.1f}%"
+            d['_eta_str'] = yt_dlp.utils.formatSeconds(max(0, self.total - self.received) / speed)
+        return d
+
+    def kill(self):
+        if self._reader is not None:
+            self._reader.cancel()
+        if self._proc is not None and self._proc.returncode is None:
+            self._proc.kill()
+
+
+def _multipart(boundary, fields, file_field, filename, chunks):
+    """Stream a multipart/form-data body whose file part comes from chunks."""
+
+    async def body():
+        for name, value in fields.items():
+            yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                   f'{value}\r\n').encode()
+        yield (f'--{boundary}\r\nContent-Disposition: form-data; name="{file_field}"; '
+               f'filename="{filename}"\r\nContent-Type: application/octet-stream\r\n\r\n').encode()
+        async for chunk in chunks:
+            yield chunk
+        yield f'\r\n--{boundary}--\r\n'.encode()
+
+    return body()
+
+
+async def stream_upload(bot, client, method, file_field, filename, chunks, **fields):
+    """Call a Bot API send method with the file streamed from chunks.
+
+    python-telegram-bot reads every InputFile fully into memory, so the
+    request is built and sent with httpx directly. Returns the sent Message.
+    """
+    boundary = uuid.uuid4().hex
+    fields = {k: json.dumps(v) if isinstance(v, bool) else v for k, v in fields.items() if v is not None}
+    response = await client.post(
+        f"{bot.base_url}/{method}",
+        content=_multipart(boundary, fields, file_field, filename, chunks),
+        headers={'Content-Type': f'multipart/form-data; boundary={boundary}'},
+    )
+    data = BaseRequest.parse_json_payload(response.content)
+    if not data.get('ok'):
+        retry_after = (data.get('parameters') or {}).get('retry_after')
+        if retry_after:
+            raise RetryAfter(retry_after)
+        if response.status_code == 400:
+            raise BadRequest(data.get('description', 'Bad Request'))
+        raise NetworkError(f"{data.get('description')} ({response.status_code})")
+    return Message.de_json(data['result'], bot)
+
+
+def upload_client():
+    """HTTP client for streamed uploads: no read/write timeout while data flows."""
+    return httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=None, write=None))
@@ -0,0 +1,17 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from botapi import file_url  # noqa: E402
+
+
+def test_file_url_rewrites_only_the_last_segment():
+    assert file_url('http://bot-api:8081/bot') == 'http://bot-api:8081/file/bot'
+    assert file_url('https://api.telegram.org/bot') == 'https://api.telegram.org/file/bot'
+    assert file_url('http://robot.example:8081/bots/bot/') == 'http://robot.example:8081/bots/file/bot'
+
+
+def test_file_url_leaves_other_urls_alone():
+    assert file_url('http://bot-api:8081/') == 'http://bot-api:8081/'
+    assert file_url('') == ''
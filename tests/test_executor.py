@@ -0,0 +1,94 @@
+import asyncio
+import os
+import sys
+
+import pytest
+import yt_dlp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from executor import Job, SingleFlight  # noqa: E402
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class Delivery:
+    """A shared run that finishes when told to, remembering whose it was."""
+
+    def __init__(self):
+        self.started = []
+        self.cancelled = []
+        self.release = asyncio.Event()
+
+    def func(self, name):
+        async def run(flight):
+            self.started.append(name)
+            try:
+                await self.release.wait()
+            except asyncio.CancelledError:
+                self.cancelled.append(name)
+                raise
+            return name
+        return run
+
+
+def test_follower_leaving_keeps_the_run():
+    async def main():
+        flights, delivery = SingleFlight(), Delivery()
+        leader_job, follower_job = Job('a'), Job('b')
+        leader = asyncio.create_task(flights.run('k', delivery.func('a'), 'msg-a', leader_job))
+        await settle()
+        follower = asyncio.create_task(flights.run('k', delivery.func('b'), 'msg-b', follower_job))
+        await settle()
+
+        follower_job.cancel()
+        with pytest.raises(yt_dlp.utils.DownloadCancelled):
+            await follower
+        delivery.release.set()
+        assert await leader == ('a', True)
+        assert delivery.started == ['a'] and delivery.cancelled == []
+
+    asyncio.run(main())
+
+
+def test_leader_leaving_hands_over_to_a_follower():
+    async def main():
+        flights, delivery = SingleFlight(), Delivery()
+        jobs = {name: Job(name) for name in 'abc'}
+        tasks = {}
+        for name in 'abc':
+            tasks[name] = asyncio.create_task(flights.run('k', delivery.func(name), f'msg-{name}', jobs[name]))
+            await settle()
+
+        jobs['a'].cancel()
+        with pytest.raises(yt_dlp.utils.DownloadCancelled):
+            await tasks['a']
+        await settle()
+        # b starts over with its own run, c joins it instead of failing
+        assert delivery.cancelled == ['a'] and delivery.started == ['a', 'b']
+        delivery.release.set()
+        assert await tasks['b'] == ('b', True)
+        assert await tasks['c'] == ('b', False)
+
+    asyncio.run(main())
+
+
+def test_run_cancelled_once_everyone_left():
+    async def main():
+        flights, delivery = SingleFlight(), Delivery()
+        jobs = [Job('a'), Job('b')]
+        tasks = [asyncio.create_task(flights.run('k', delivery.func('a'), None, job)) for job in jobs]
+        await settle()
+        jobs[1].cancel()
+        jobs[0].cancel()
+        for task in tasks:
+            with pytest.raises(yt_dlp.utils.DownloadCancelled):
+                await task
+        await settle()
+        assert delivery.cancelled == ['a']
+        assert flights._flights == {}
+
+    asyncio.run(main())
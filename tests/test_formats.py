@@ -0,0 +1,90 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from formats import OVERHEAD, estimate_size, pick_audio, rank_formats  # noqa: E402
+
+MB = 1024 * 1024
+
+# Trimmed from a YouTube extraction: two progressive formats, DASH video
+# at three heights and two audio streams
+YOUTUBE = {
+    'duration': 212,
+    'formats': [
+        {'format_id': '249', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 50.8, 'filesize': 1312398},
+        {'format_id': '251', 'ext': 'webm', 'vcodec': 'none', 'acodec': 'opus', 'abr': 135.4, 'filesize': 3437753},
+        {'format_id': '140', 'ext': 'm4a', 'vcodec': 'none', 'acodec': 'mp4a.40.2', 'abr': 129.5,
+         'filesize': 3433514},
+        {'format_id': '18', 'ext': 'mp4', 'vcodec': 'avc1.42001E', 'acodec': 'mp4a.40.2', 'height': 360,
+         'tbr': 503.7, 'filesize_approx': 13349018},
+        {'format_id': '22', 'ext': 'mp4', 'vcodec': 'avc1.64001F', 'acodec': 'mp4a.40.2', 'height': 720,
+         'tbr': 1497.6},
+        {'format_id': '134', 'ext': 'mp4', 'vcodec': 'avc1.4d401e', 'acodec': 'none', 'height': 360,
+         'vbr': 304.1, 'filesize': 8063446},
+        {'format_id': '136', 'ext': 'mp4', 'vcodec': 'avc1.4d401f', 'acodec': 'none', 'height': 720,
+         'vbr': 1060.3, 'filesize': 28112634},
+        {'format_id': '137', 'ext': 'mp4', 'vcodec': 'avc1.640028', 'acodec': 'none', 'height': 1080,
+         'vbr': 4465.9, 'filesize': 118398502},
+    ],
+}
+
+# Trimmed from a Vimeo extraction: progressive files without any size or
+# bitrate, next to an HLS rendition that has one
+VIMEO = {
+    'duration': 62,
+    'formats': [
+        {'format_id': 'http-240p', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 240},
+        {'format_id': 'http-540p', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 540},
+        {'format_id': 'hls-540p', 'ext': 'mp4', 'vcodec': 'avc1', 'acodec': 'mp4a', 'height': 540, 'tbr': 1200},
+    ],
+}
+
+
+def specs(options):
+    return [option.spec for option in options]
+
+
+def test_limit_drops_larger_options():
+    assert specs(rank_formats(YOUTUBE, 50 * MB, allow_merge=False)) == ['22', '18']
+    # 22 has no size of its own, but its bitrate puts it at ~39MB
+    assert specs(rank_formats(YOUTUBE, 20 * MB, allow_merge=False)) == ['18']
+    assert rank_formats(YOUTUBE, 10 * MB, allow_merge=False) == []
+
+
+def test_merge_candidates():
+    options = rank_formats(YOUTUBE, 50 * MB, allow_merge=True)
+    assert specs(options) == ['136+140', '134+140']
+    assert all(option.merged for option in options)
+    assert options[0].size == 28112634 + 3433514
+    # Room for 1080p too, up to max_options
+    options = rank_formats(YOUTUBE, 200 * MB, max_options=2, allow_merge=True)
+    assert specs(options) == ['137+140', '136+140']
+
+
+def test_without_merge_only_progressive():
+    options = rank_formats(YOUTUBE, 200 * MB, allow_merge=False)
+    assert specs(options) == ['22', '18']
+    assert not any(option.merged for option in options)
+
+
+def test_unknown_size_only_fills_gaps():
+    options = rank_formats(VIMEO, 50 * MB, allow_merge=False)
+    assert specs(options) == ['hls-540p', 'http-240p']
+    assert options[1].size is None
+    assert options[1].label == "📹 Video 240p (size unknown)"
+
+
+def test_pick_audio_prefers_mp4_compatible():
+    assert pick_audio(YOUTUBE['formats'])['format_id'] == '140'
+    assert pick_audio([f for f in YOUTUBE['formats'] if f['ext'] == 'webm'])['format_id'] == '251'
+    assert pick_audio(VIMEO['formats']) is None
+
+
+def test_estimate_size_fallbacks():
+    assert estimate_size({'filesize': 100, 'filesize_approx': 200, 'tbr': 8}, 10) == 100
+    assert estimate_size({'filesize_approx': 200, 'tbr': 8}, 10) == 200
+    assert estimate_size({'tbr': 8}, 10) == int(1000 * 10 * OVERHEAD)
+    assert estimate_size({'vbr': 6, 'abr': 2}, 10) == int(1000 * 10 * OVERHEAD)
+    assert estimate_size({'tbr': 8}, None) is None
+    assert estimate_size({}, 10) is None
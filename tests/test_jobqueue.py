@@ -0,0 +1,43 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from jobqueue import JobQueue  # noqa: E402
+
+
+def test_crashed_job_loses_its_lease(tmp_path):
+    jobs = JobQueue(str(tmp_path / 'jobs.db'))
+    alive = jobs.submit(1, 1, 'https://example.com/a', 'best')
+    crashed = jobs.submit(2, 2, 'https://example.com/b', 'best')
+    assert [job.id for job in jobs.claim('w1', 2, 0)] == [alive.id, crashed.id]
+
+    # Only the job whose task still runs is renewed
+    assert jobs.renew('w1', 60, [alive.id]) == []
+    time.sleep(0.01)
+    assert jobs.requeue_expired() == 1
+    assert [job.id for job in jobs.claim('w2', 2, 60)] == [crashed.id]
+
+
+def test_renew_reports_cancelled_jobs(tmp_path):
+    jobs = JobQueue(str(tmp_path / 'jobs.db'))
+    job = jobs.submit(1, 1, 'https://example.com/a', 'best')
+    jobs.claim('w1', 1, 60)
+    assert jobs.renew('w1', 60, []) == []
+    assert jobs.cancel(1) == 1
+    assert jobs.renew('w1', 60, [job.id]) == [(job.id, 1)]
+
+
+def test_claim_takes_turns_between_users(tmp_path):
+    jobs = JobQueue(str(tmp_path / 'jobs.db'))
+    busy = [jobs.submit(1, 1, f'https://example.com/{i}', 'best').id for i in range(6)]
+    other = jobs.submit(2, 2, 'https://example.com/other', 'best').id
+
+    claimed = [job.id for job in jobs.claim('w1', 6, 60, per_user=3)]
+    assert claimed == [busy[0], other, busy[1], busy[2]]
+    # The cap counts jobs already running, on any worker
+    assert jobs.claim('w2', 6, 60, per_user=3) == []
+    jobs.finish(busy[0])
+    assert [job.id for job in jobs.claim('w2', 6, 60, per_user=3)] == [busy[3]]
+    assert [job.id for job in jobs.claim('w2', 6, 60)] == busy[4:]
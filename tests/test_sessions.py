@@ -0,0 +1,31 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sessions import ChoiceStore  # noqa: E402
+
+
+def test_choices_survive_a_restart(tmp_path):
+    path = str(tmp_path / 'jobs.db')
+    token = ChoiceStore(path).add(1, 2, 'https://example.com/v', 'audio')
+
+    store = ChoiceStore(path)
+    choice = store.get(token)
+    assert (choice.user_id, choice.chat_id, choice.url, choice.format_type) == (1, 2, 'https://example.com/v', 'audio')
+    assert store.pop(token).url == 'https://example.com/v'
+    assert store.pop(token) is None and store.get(token) is None
+
+
+def test_choices_expire_and_are_evicted(tmp_path):
+    store = ChoiceStore(str(tmp_path / 'jobs.db'), ttl=0.05, max_entries=2)
+    old = store.add(1, 1, 'a', 'best')
+    time.sleep(0.1)
+    assert store.get(old) is None and store.pop(old) is None
+
+    store.ttl = 60
+    tokens = [store.add(1, 1, url, 'best') for url in 'bcd']
+    assert len(store) == 2
+    assert store.get(tokens[0]) is None
+    assert [store.get(token).url for token in tokens[1:]] == ['c', 'd']
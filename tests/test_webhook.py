@@ -0,0 +1,65 @@
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from webhook import InFlight, WebhookServer  # noqa: E402
+
+
+async def post(port, update_id, secret=b'secret'):
+    """Deliver one update like Telegram does, returns the status code."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    body = json.dumps({'update_id': update_id}).encode()
+    writer.write(b'POST /hook HTTP/1.1\r\nHost: bot\r\nConnection: close\r\n'
+                 b'X-Telegram-Bot-Api-Secret-Token: ' + secret + b'\r\n'
+                 b'Content-Length: ' + str(len(body)).encode() + b'\r\n\r\n' + body)
+    status = await reader.readline()
+    writer.close()
+    return int(status.split()[1])
+
+
+def test_webhook_refuses_once_updates_pile_up():
+    async def main():
+        # Handlers that never finish: nothing gives its slot back on its own
+        in_flight = InFlight(2)
+        taken = []
+
+        async def ingest(data, payload):
+            if not await in_flight.admit(data['update_id'], 0.05):
+                return False
+            taken.append(data['update_id'])
+            return True
+
+        server = WebhookServer(ingest, '/hook', secret='secret')
+        await server.start('127.0.0.1', 0)
+        port = server._server.sockets[0].getsockname()[1]
+        try:
+            assert [await post(port, update_id) for update_id in (1, 2, 3)] == [200, 200, 503]
+            assert taken == [1, 2] and len(in_flight) == 2
+            # Once an update is handled Telegram's redelivery gets in
+            in_flight.done(1)
+            assert await post(port, 3) == 200
+            assert taken == [1, 2, 3]
+        finally:
+            await server.close()
+
+    asyncio.run(main())
+
+
+def test_polling_stalls_until_an_update_is_done():
+    async def main():
+        in_flight = InFlight(1)
+        assert await in_flight.admit(1)
+        waiting = asyncio.create_task(in_flight.admit(2))
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        # The same update again takes no second slot
+        assert await in_flight.admit(1, 0)
+        in_flight.done(1)
+        assert await asyncio.wait_for(waiting, 1)
+        in_flight.done(1)
+        assert len(in_flight) == 1
+
+    asyncio.run(main())
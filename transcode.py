@@ -0,0 +1,100 @@
+import asyncio
+import logging
+import os
+import re
+
+logger = logging.getLogger(__name__)
+
+# ffmpeg -benchmark prints e.g. "bench: utime=1.234s stime=0.056s rtime=0.789s"
+BENCH = re.compile(r'bench: utime=([\d.]+)s stime=([\d.]+)s')
+
+# Source codecs Telegram plays as audio, and the container each goes in
+AUDIO_CONTAINERS = {'mp3': 'mp3', 'mp4a': 'm4a', 'aac': 'm4a'}
+
+# How often a running ffmpeg checks whether its job was cancelled
+CANCEL_POLL = 0.5
+
+
+class Preset:
+    """ffmpeg output settings for one kind of conversion.
+
+    `passthrough` lists source codecs that are sent without re-encoding:
+    as they are when already in the right container, else stream-copied
+    into one. Only software encoders are used, so presets work anywhere.
+    """
+
+    __slots__ = ('name', 'codec', 'ext', 'bitrate', 'threads', 'passthrough')
+
+    def __init__(self, name, codec, ext, bitrate, threads=1, passthrough=()):
+        self.name = name
+        self.codec = codec
+        self.ext = ext
+        self.bitrate = bitrate
+        self.threads = threads
+        self.passthrough = tuple(passthrough)
+
+    def accepts(self, acodec):
+        """True if audio in acodec can be sent without re-encoding."""
+        acodec = (acodec or '').split('.')[0].lower()
+        return acodec in self.passthrough and acodec in AUDIO_CONTAINERS
+
+    def encode_args(self):
+        return ['-c:a', self.codec, '-b:a', f'{self.bitrate}k', '-threads', str(self.threads)]
+
+
+class Transcoder:
+    """Runs ffmpeg as asyncio subprocesses, at most `max_procs` at a time."""
+
+    def __init__(self, max_procs=None):
+        self.max_procs = max_procs or os.cpu_count() or 1
+        self._slots = asyncio.Semaphore(self.max_procs)
+
+    async def audio(self, src, acodec, preset, job=None):
+        """Turn the downloaded file src into an audio file for preset.
+
+        Returns (path, cpu_seconds); cpu_seconds is 0 when ffmpeg did not run.
+        """
+        stem, ext = os.path.splitext(src)
+        if preset.accepts(acodec):
+            container = AUDIO_CONTAINERS[acodec.split('.')[0].lower()]
+            if ext.lstrip('.') == container:
+                return src, 0.0
+            args, dst = ['-c:a', 'copy'], f'{stem}.{container}'
+        else:
+            args, dst = preset.encode_args(), f'{stem}.{preset.ext}'
+        if dst == src:
+            dst = f'{stem}.{preset.name}.{preset.ext}'
+
+        cpu = await self.run(['-i', src, '-vn', *args, dst], job)
+        logger.info(f"{preset.name}: {os.path.basename(dst)} took {cpu:.2f}s of CPU")
+        return dst, cpu
+
+    async def run(self, args, job=None):
+        """Run ffmpeg with args, returns the CPU seconds it used."""
+        async with self._slots:
+            proc = await asyncio.create_subprocess_exec(
+                'ffmpeg', '-hide_banner', '-nostdin', '-y', '-benchmark', *args,
+                stdout=asyncio.subprocess.DEVNULL,
+                stderr=asyncio.subprocess.PIPE,
+            )
+            stderr = asyncio.ensure_future(proc.stderr.read())
+            try:
+                while True:
+                    try:
+                        await asyncio.wait_for(asyncio.shield(stderr), CANCEL_POLL)
+                        break
+                    except asyncio.TimeoutError:
+                        if job is not None:
+                            job.check()
+                returncode = await proc.wait()
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                stderr.cancel()
+
+        output = stderr.result().decode(errors='replace')
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg failed: {output.strip().splitlines()[-1] if output.strip() else returncode}")
+        match = BENCH.search(output)
+        return float(match.group(1)) + float(match.group(2)) if match else 0.0
@@ -0,0 +1,245 @@
+import heapq
+import ipaddress
+import logging
+import posixpath
+import re
+import time
+from urllib.parse import urlsplit
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+logger = logging.getLogger(__name__)
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"]+')
+
+# Ends a sentence rather than the link in it
+TRAILING_PUNCTUATION = '.,;:!?\''
+
+# Closing brackets and their openers; a closing one the link does not open is
+# the sentence's
+BRACKETS = {')': '(', ']': '[', '}': '{'}
+
+# Links to these are media files the generic extractor downloads directly
+MEDIA_EXTENSIONS = {
+    '.mp4', '.m4v', '.webm', '.mkv', '.mov', '.avi', '.flv', '.ts', '.m3u8', '.mpd',
+    '.mp3', '.m4a', '.aac', '.ogg', '.opus', '.wav', '.flac',
+}
+
+# Links to these are never media
+OTHER_EXTENSIONS = {
+    '.pdf', '.doc', '.docx', '.xls', '.xlsx', '.ppt', '.pptx', '.txt', '.csv',
+    '.zip', '.rar', '.7z', '.tar', '.gz', '.exe', '.msi', '.apk', '.dmg', '.iso',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.svg',
+}
+
+# Second-level labels under which names are registered, as in example.co.uk
+PUBLIC_SECOND_LEVEL = {'co', 'com', 'net', 'org', 'ac', 'gov', 'edu', 'ne', 'or', 'go'}
+
+# Names that never resolve to a public site
+INTERNAL_SUFFIXES = ('.localhost', '.local', '.internal', '.lan', '.home.arpa')
+
+# Stop expanding a pattern's alternatives past this many strings
+MAX_EXPANSION = 4096
+
+# Stands for any text in an expanded pattern
+WILDCARD = '\0'
+
+HOST_END = re.compile(r'[/?#:]')
+HOST_NAME = re.compile(r'[a-z0-9.-]+')
+
+
+def find_urls(text):
+    """The distinct http(s) links in a message, in order."""
+    return list(dict.fromkeys(filter(None, map(_trim_url, URL_PATTERN.findall(text)))))
+
+
+def _trim_url(url):
+    """url without the punctuation of the sentence around it."""
+    while True:
+        url = url.rstrip(TRAILING_PUNCTUATION)
+        closing = url[-1:]
+        if closing not in BRACKETS or url.count(BRACKETS[closing]) >= url.count(closing):
+            break
+        url = url[:-1]
+    return url if '://' in url and url.split('://', 1)[1] else None
+
+
+def site_key(host):
+    """The registered domain of a host name (youtube.com for m.youtube.com)."""
+    labels = host.lower().rstrip('.').split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in PUBLIC_SECOND_LEVEL:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+
+def _expand(items):
+    """Strings a parsed regex can match, with WILDCARD for anything open-ended.
+
+    Returns None when there are more than MAX_EXPANSION of them.
+    """
+    results = ['']
+    for op, arg in items:
+        if op is sre_parse.LITERAL:
+            options = [chr(arg).lower()]
+        elif op is sre_parse.IN:
+            # [yY] and the like spell out a case-insensitive letter
+            chars = {chr(value).lower() for kind, value in arg if kind is sre_parse.LITERAL}
+            options = list(chars) if len(chars) == 1 and len(arg) <= 2 else [WILDCARD]
+        elif op is sre_parse.SUBPATTERN:
+            options = _expand(arg[-1])
+        elif op is sre_parse.BRANCH:
+            options = []
+            for branch in arg[1]:
+                expanded = _expand(branch)
+                if expanded is None:
+                    return None
+                options.extend(expanded)
+        elif op in (sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT):
+            low, high, item = arg
+            if high > 1:
+                options = [WILDCARD]
+            else:
+                options = _expand(item)
+                if options is not None and low == 0:
+                    options.append('')
+        elif op in (sre_parse.AT, sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            options = ['']
+        else:
+            options = [WILDCARD]
+        if options is None or len(results) * len(options) > MAX_EXPANSION:
+            return None
+        results = [prefix + option for prefix in results for option in options]
+    return results
+
+
+def pattern_sites(pattern):
+    """site_key()s of all hosts a _VALID_URL pattern accepts, empty if any is unknown."""
+    try:
+        expanded = _expand(sre_parse.parse(pattern))
+    except (re.error, RecursionError, TypeError):
+        return set()
+    sites = set()
+    for text in expanded or ():
+        host = HOST_END.split(text.split('://', 1)[-1], 1)[0]
+        host = host.rsplit(WILDCARD, 1)[-1].lstrip('.')
+        if not ('.' in host and HOST_NAME.fullmatch(host) and host.rsplit('.', 1)[-1].isalpha()):
+            return set()
+        sites.add(site_key(host))
+    return sites
+
+
+class Route:
+    """What triage made of a link.
+
+    ie_key names the extractor to use, None to let yt-dlp look for one.
+    generic: no site extractor takes the link; direct: it points at a media
+    file. rejected holds why the link is not worth extracting, if so.
+    """
+
+    __slots__ = ('url', 'ie_key', 'generic', 'direct', 'rejected')
+
+    def __init__(self, url, ie_key=None, generic=False, direct=False, rejected=None):
+        self.url = url
+        self.ie_key = ie_key
+        self.generic = generic
+        self.direct = direct
+        self.rejected = rejected
+
+    @property
+    def outcome(self):
+        if self.rejected:
+            return 'rejected'
+        if self.ie_key:
+            return 'site'
+        return 'generic' if self.generic else 'unknown'
+
+
+class Triage:
+    """Routes links to their yt-dlp extractor without asking every extractor.
+
+    build() indexes the extractors by the sites their _VALID_URL patterns
+    name. route() then only tries the extractors for the link's site, and
+    the few whose patterns name no site, in yt-dlp's own order. Links to
+    local or private addresses are refused unless allow_private is set;
+    until the index is built, all others are passed through untouched.
+    """
+
+    def __init__(self, reject_generic=False, allow_private=False):
+        self.reject_generic = reject_generic
+        self.allow_private = allow_private
+        self.ready = False
+        self._sites = {}
+        self._unindexed = []
+
+    def build(self):
+        """Index yt-dlp's extractors; takes a moment, call it off the event loop."""
+        started = time.monotonic()
+        sites = {}
+        unindexed = []
+        for order, ie in enumerate(yt_dlp.extractor.gen_extractor_classes()):
+            if ie.ie_key() == 'Generic':
+                continue
+            patterns = ie._VALID_URL
+            if isinstance(patterns, str):
+                patterns = [patterns]
+            elif not isinstance(patterns, (list, tuple)):
+                # Extractors without a pattern only take URLs of their own making
+                continue
+            keys = set()
+            for pattern in patterns:
+                found = pattern_sites(pattern)
+                if not found:
+                    keys = None
+                    break
+                keys |= found
+            entry = (order, ie)
+            if keys:
+                for key in keys:
+                    sites.setdefault(key, []).append(entry)
+            else:
+                unindexed.append(entry)
+        self._sites, self._unindexed = sites, unindexed
+        self.ready = True
+        logger.info(f"Indexed extractors for {len(sites)} sites ({len(unindexed)} unindexed) "
+                    f"in {time.monotonic() - started:.2f}s")
+
+    def route(self, url):
+        parts = urlsplit(url)
+        try:
+            host = (parts.hostname or '').lower()
+        except ValueError:
+            host = ''
+        if not host:
+            return Route(url, rejected="not a web address")
+        if not self.allow_private and not _public_host(host):
+            return Route(url, rejected="not a public address")
+        if not self.ready:
+            return Route(url)
+
+        for _, ie in heapq.merge(self._sites.get(site_key(host), ()), self._unindexed, key=lambda entry: entry[0]):
+            if ie.suitable(url):
+                return Route(url, ie_key=ie.ie_key())
+
+        extension = posixpath.splitext(parts.path)[1].lower()
+        if extension in MEDIA_EXTENSIONS:
+            return Route(url, generic=True, direct=True)
+        if extension in OTHER_EXTENSIONS:
+            return Route(url, generic=True, rejected="not a media link")
+        if self.reject_generic:
+            return Route(url, generic=True, rejected="site not supported")
+        return Route(url, generic=True)
+
+
+def _public_host(host):
+    """False for localhost, bare names and internal IP addresses."""
+    try:
+        return ipaddress.ip_address(host).is_global
+    except ValueError:
+        return '.' in host and not host.endswith(INTERNAL_SUFFIXES)
@@ -0,0 +1,156 @@
+import asyncio
+import hmac
+import json
+import logging
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+# Telegram posts one update per request, far below this
+MAX_BODY = 1024 * 1024
+
+SECRET_HEADER = b'x-telegram-bot-api-secret-token'
+
+
+class RecentIds:
+    """The last `size` update ids taken, to drop Telegram's redeliveries."""
+
+    def __init__(self, size=10000):
+        self.size = size
+        self._ids = OrderedDict()
+
+    def add(self, update_id):
+        """Remember update_id, returns False if it was already there."""
+        if update_id in self._ids:
+            return False
+        self._ids[update_id] = None
+        if len(self._ids) > self.size:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, update_id):
+        self._ids.pop(update_id, None)
+
+
+class InFlight:
+    """Caps the updates taken in but not handled yet, queued or running.
+
+    PTB takes updates off its queue as they come and starts a task for
+    each, so a bounded queue alone never fills up. admit() waits for one of
+    `limit` slots, done() gives the update's slot back.
+    """
+
+    def __init__(self, limit):
+        self.limit = limit
+        self._slots = asyncio.Semaphore(limit)
+        self._ids = set()
+
+    def __len__(self):
+        return len(self._ids)
+
+    async def admit(self, update_id, timeout=None):
+        """Take a slot for update_id, returns False if none came free within timeout seconds."""
+        if update_id in self._ids:
+            return True
+        try:
+            await asyncio.wait_for(self._slots.acquire(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        self._ids.add(update_id)
+        return True
+
+    def done(self, update_id):
+        if update_id in self._ids:
+            self._ids.discard(update_id)
+            self._slots.release()
+
+
+class WebhookServer:
+    """Telegram's webhook on a small asyncio HTTP server.
+
+    Each POST to `path` must carry the secret token. `await ingest(data, payload)`
+    takes the parsed update and its raw JSON, and the request is answered as
+    soon as it returns. When it returns False (no room for the update)
+    Telegram gets a 503 and delivers the update again later. Update ids taken
+    recently are answered 200 without calling ingest.
+    """
+
+    def __init__(self, ingest, path, secret=None, recent=None):
+        self.ingest = ingest
+        self.path = path.encode()
+        self.secret = secret.encode() if secret else None
+        self.recent = recent if recent is not None else RecentIds()
+        self._server = None
+        # Connection handler tasks and their writers
+        self._connections = {}
+
+    async def start(self, host, port):
+        self._server = await asyncio.start_server(self._handle, host, port)
+
+    async def close(self):
+        if self._server is not None:
+            self._server.close()
+            self._server = None
+        # Telegram keeps connections open, hang up on the idle ones ourselves
+        for writer in self._connections.values():
+            writer.transport.abort()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+
+    async def _handle(self, reader, writer):
+        task = asyncio.current_task()
+        self._connections[task] = writer
+        try:
+            while True:
+                try:
+                    status, keep_alive = await self._request(reader)
+                except Exception as e:
+                    if not isinstance(e, (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError)):
+                        logger.error(f"Webhook request failed: {e}")
+                        writer.write(b'HTTP/1.1 500 Internal Server Error\r\nContent-Length: 0\r\n'
+                                     b'Connection: close\r\n\r\n')
+                    break
+                writer.write(f'HTTP/1.1 {status}\r\nContent-Length: 0\r\n'
+                             f'Connection: {"keep-alive" if keep_alive else "close"}\r\n\r\n'.encode())
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except ConnectionError:
+            pass
+        finally:
+            self._connections.pop(task, None)
+            writer.close()
+
+    async def _request(self, reader):
+        """Read and answer one request; returns the status line and whether to keep the connection."""
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), 60)
+        lines = head.split(b'\r\n')
+        parts = lines[0].split(b' ')
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(b':')
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get(b'content-length') or 0)
+        if length > MAX_BODY:
+            return '413 Payload Too Large', False
+        body = await asyncio.wait_for(reader.readexactly(length), 60) if length else b''
+        keep_alive = headers.get(b'connection', b'').lower() != b'close'
+        if len(parts) < 2 or parts[0] != b'POST' or parts[1].split(b'?')[0] != self.path:
+            return '404 Not Found', keep_alive
+        if self.secret and not hmac.compare_digest(headers.get(SECRET_HEADER, b''), self.secret):
+            return '403 Forbidden', keep_alive
+        try:
+            data = json.loads(body)
+            update_id = data['update_id']
+        except (ValueError, KeyError, TypeError):
+            return '400 Bad Request', keep_alive
+        if not self.recent.add(update_id):
+            return '200 OK', keep_alive
+        try:
+            taken = await self.ingest(data, body.decode())
+        except BaseException:
+            self.recent.discard(update_id)
+            raise
+        if not taken:
+            self.recent.discard(update_id)
+            return '503 Service Unavailable', keep_alive
+        return '200 OK', keep_alive
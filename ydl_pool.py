@@ -0,0 +1,154 @@
+import contextlib
+import logging
+import threading
+
+from lazy import LazyModule
+
+yt_dlp = LazyModule('yt_dlp')
+
+logger = logging.getLogger(__name__)
+
+# Options a lease may change; YoutubeDL reads all others only in __init__ or
+# keeps derived state for them, so they are part of the pool key instead
+OVERRIDABLE = {
+    'outtmpl', 'format', 'progress_hooks',
+    'extract_flat', 'lazy_playlist', 'playlistend', 'noplaylist',
+    'concurrent_fragment_downloads', 'http_chunk_size',
+    'external_downloader', 'external_downloader_args',
+}
+
+
+def _key(options):
+    return repr(sorted(options.items()))
+
+
+class YoutubeDLPool:
+    """Warm YoutubeDL instances, reused across jobs instead of built per call.
+
+    A reused instance keeps its extractor instances (with their player JS
+    and signature caches), cookie jar and HTTP connections. Instances are
+    grouped by their base options; lease() hands one out to a single thread
+    with per-job overrides applied and puts them back afterwards. At most
+    `max_idle` instances per key are kept, and each is closed and replaced
+    after `max_uses` leases so that caches do not grow without bound.
+    """
+
+    def __init__(self, base=None, max_idle=4, max_uses=200):
+        self.base = dict(base or {})
+        self.max_idle = max_idle
+        self.max_uses = max_uses
+        self.created = 0
+        self.reused = 0
+        self._idle = {}
+        self._uses = {}
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def lease(self, overrides=None, **options):
+        """A YoutubeDL for the with-block: base options + options, then overrides.
+
+        overrides may only hold OVERRIDABLE keys; they are undone on exit.
+        """
+        overrides = dict(overrides or {})
+        unknown = set(overrides) - OVERRIDABLE
+        if unknown:
+            raise ValueError(f"options {sorted(unknown)} cannot be set per job")
+        options = {**self.base, **options}
+        key = _key(options)
+        ydl = self._take(key, options)
+        saved = self._save(ydl, overrides)
+        reusable = True
+        try:
+            self._apply(ydl, overrides)
+            yield ydl
+        except BaseException as e:
+            # Download errors and cancellations leave the instance usable, an
+            # interruption mid-call (KeyboardInterrupt, ...) does not
+            reusable = isinstance(e, Exception)
+            raise
+        finally:
+            self._restore(ydl, saved)
+            self._give_back(key, ydl, reusable)
+
+    def warm(self, count=1, **options):
+        """Build count instances ahead of the first jobs."""
+        options = {**self.base, **options}
+        key = _key(options)
+        for _ in range(count):
+            self._give_back(key, self._build(options), True)
+
+    def close(self):
+        """Close every idle instance."""
+        with self._lock:
+            idle, self._idle = self._idle, {}
+        for instances in idle.values():
+            for ydl in instances:
+                self._close(ydl)
+
+    @property
+    def idle(self):
+        with self._lock:
+            return sum(len(instances) for instances in self._idle.values())
+
+    def _build(self, options):
+        ydl = yt_dlp.YoutubeDL(dict(options))
+        with self._lock:
+            self.created += 1
+            self._uses[id(ydl)] = 0
+        return ydl
+
+    def _take(self, key, options):
+        with self._lock:
+            instances = self._idle.get(key)
+            if instances:
+                self.reused += 1
+                return instances.pop()
+        return self._build(options)
+
+    def _give_back(self, key, ydl, reusable):
+        with self._lock:
+            uses = self._uses.get(id(ydl), 0) + 1
+            instances = self._idle.setdefault(key, [])
+            if reusable and uses <= self.max_uses and len(instances) < self.max_idle:
+                self._uses[id(ydl)] = uses
+                instances.append(ydl)
+                return
+            self._uses.pop(id(ydl), None)
+        self._close(ydl)
+
+    @staticmethod
+    def _save(ydl, overrides):
+        """What _restore() needs to undo overrides on ydl."""
+        params = ydl.params
+        return ({k: params[k] for k in overrides if k in params}, set(overrides) - set(params),
+                ydl.format_selector, list(ydl._progress_hooks))
+
+    @staticmethod
+    def _apply(ydl, overrides):
+        params = ydl.params
+        for name, value in overrides.items():
+            if name == 'outtmpl':
+                # YoutubeDL keeps outtmpl as a dict of templates per output kind
+                value = {**params.get('outtmpl', {}), 'default': value}
+            elif name == 'format':
+                ydl.format_selector = value if value in (None, '-') or callable(value) else ydl.build_format_selector(value)
+            elif name == 'progress_hooks':
+                ydl._progress_hooks = list(value)
+            params[name] = value
+
+    @staticmethod
+    def _restore(ydl, saved):
+        previous, added, format_selector, progress_hooks = saved
+        for name in added:
+            ydl.params.pop(name, None)
+        ydl.params.update(previous)
+        ydl.format_selector = format_selector
+        ydl._progress_hooks = progress_hooks
+        ydl._download_retcode = 0
+
+    @staticmethod
+    def _close(ydl):
+        try:
+            ydl.close()
+        except Exception as e:
+            logger.warning(f"Closing a pooled YoutubeDL failed: {e}")